@@ -0,0 +1,185 @@
+""" asyncio-based HTTP/1.1 server with support for persistent connections. Requests are
+    processed by the same handler class used by the threaded server, which runs on a
+    bounded pool of threads so that blocking calls to the proxy don't stall the loop """
+
+from concurrent.futures import ThreadPoolExecutor
+from http.client import parse_headers
+from io import BytesIO
+import asyncio
+import os
+
+from backend.utils.log import get_logger
+
+MAX_WORKERS = int(os.environ.get("BACKEND_MAX_WORKERS", 16))
+KEEP_ALIVE_TIMEOUT = float(os.environ.get("BACKEND_KEEP_ALIVE_TIMEOUT", 15))
+MAX_HEADER_LINES = 100
+
+logger = get_logger("backend")
+
+
+def get_buffered_handler(handler_class):
+    """ Returns a subclass of the given BaseHTTPRequestHandler subclass that processes
+        an already parsed request and captures the response in memory instead of
+        writing it to a socket """
+
+    class BufferedHandler(handler_class):
+        """ Runs the do_<METHOD> methods of the handler against an in-memory request """
+
+        def __init__(self, command, path, request_version, headers, body,
+                     client_address):
+            # BaseRequestHandler.__init__ is skipped on purpose since it reads the
+            # request from a socket and that is taken care of by the server
+            self.command = command
+            self.path = path
+            self.request_version = request_version
+            self.requestline = "{} {} {}".format(command, path, request_version)
+            self.headers = headers
+            self.client_address = client_address
+            self.rfile = BytesIO(body)
+            self.wfile = BytesIO()
+            self.close_connection = False
+            self.status = None
+            self.response_headers = []
+
+        def send_response(self, code, message=None):
+            self.log_request(code)
+            if message is None:
+                message = self.responses.get(code, ("",))[0]
+            self.status = (code, message)
+            self.response_headers = [
+                ("Server", self.version_string()),
+                ("Date", self.date_time_string())]
+
+        def send_header(self, keyword, value):
+            # Both headers are computed by the server once the response is complete
+            if keyword.lower() == "connection":
+                if value.lower() == "close":
+                    self.close_connection = True
+            elif keyword.lower() != "content-length":
+                self.response_headers.append((keyword, value))
+
+        def end_headers(self):
+            pass
+
+        def handle_request(self, keep_alive):
+            """ Processes the request and returns the encoded response along with
+                whether the connection can be kept open afterwards """
+
+            method = getattr(self, "do_" + self.command, None)
+            if method is None:
+                self.send_error(501, "Unsupported method ({})".format(self.command))
+            else:
+                try:
+                    method()
+                except Exception as exc:
+                    logger.error("Error while processing %s: %s",
+                                 self.requestline, exc)
+                    self.wfile = BytesIO()
+                    self.send_error(500, "Internal server error")
+
+            keep_alive = keep_alive and not self.close_connection
+            code, message = self.status
+            body = self.wfile.getvalue()
+
+            lines = ["HTTP/1.1 {} {}".format(code, message)]
+            lines.extend("{}: {}".format(k, v) for k, v in self.response_headers)
+            if code >= 200 and code not in (204, 304):
+                lines.append("Content-Length: {}".format(len(body)))
+            lines.append("Connection: {}".format(
+                "keep-alive" if keep_alive else "close"))
+            head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "strict")
+            return head + body, keep_alive
+
+    return BufferedHandler
+
+
+class AsyncServer:
+    """ Serves the requests of each connection sequentially from an asyncio loop,
+        keeping the connections open as mandated by HTTP/1.1 """
+
+    def __init__(self, server_address, handler_class,
+                 max_workers=MAX_WORKERS, keep_alive_timeout=KEEP_ALIVE_TIMEOUT):
+        self.server_address = server_address
+        self.handler_class = get_buffered_handler(handler_class)
+        self.keep_alive_timeout = keep_alive_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+
+    def serve_forever(self):
+        """ Starts listening and runs the loop until it's interrupted """
+
+        asyncio.set_event_loop(self._loop)
+        host, port = self.server_address
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle_connection, host, port))
+        self._loop.run_forever()
+
+    def shutdown(self):
+        """ Stops accepting connections and releases the worker threads """
+
+        if self._server is not None:
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+        self._executor.shutdown()
+        self._loop.close()
+
+    async def _read_request(self, reader):
+        """ Returns (command, path, version, headers, body) for the next request of
+            the connection or None if the client closed it """
+
+        request_line = await asyncio.wait_for(
+            reader.readline(), self.keep_alive_timeout)
+        if not request_line:
+            return None
+
+        command, path, version = request_line.decode("latin-1").split()
+
+        raw_headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            raw_headers.append(line)
+            if len(raw_headers) > MAX_HEADER_LINES:
+                raise ValueError("Too many headers")
+        headers = parse_headers(BytesIO(b"".join(raw_headers) + b"\r\n"))
+
+        body = await reader.readexactly(int(headers.get("Content-Length", 0)))
+        return command, path, version, headers, body
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info("peername")
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await self._read_request(reader)
+                except asyncio.TimeoutError:
+                    break
+                except ValueError as exc:
+                    logger.debug("Malformed request from %s: %s",
+                                 client_address, exc)
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\n"
+                                 b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                if request is None:
+                    break
+
+                command, path, version, headers, body = request
+                connection = headers.get("Connection", "").lower()
+                if version == "HTTP/1.1":
+                    keep_alive = connection != "close"
+                else:
+                    keep_alive = connection == "keep-alive"
+
+                handler = self.handler_class(
+                    command, path, version, headers, body, client_address)
+                response, keep_alive = await self._loop.run_in_executor(
+                    self._executor, handler.handle_request, keep_alive)
+                writer.write(response)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
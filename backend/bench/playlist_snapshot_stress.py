@@ -0,0 +1,99 @@
+""" Concurrency stress test of the reads of the democratic playlist while votes stream
+    in. Readers fetch random pages of the playlist, either from the snapshots without
+    any lock or holding the playlist lock as they did before the snapshots, and the
+    latency percentiles of the reads are reported for several amounts of writers.
+
+    Run from the root of the repository:
+        PYTHONPATH=. python backend/bench/playlist_snapshot_stress.py \
+            [tracks] [secs] [pause_ms]
+
+    `pause_ms` is how long readers sleep between reads. Readers that never sleep
+    compete with the writers for the GIL, which isn't what HTTP handlers do
+"""
+
+from threading import Event, Thread
+import random
+import sys
+import time
+
+from backend.utils.backend_adapter import TrackInfo
+from backend.utils.democratic_playlist import DemocraticPlaylist
+
+READERS = 4
+PAGE_SIZE = 50
+VOTES_PER_BATCH = 5
+
+
+class Playlist(DemocraticPlaylist):
+    def _update_default_playlist(self):
+        pass
+
+
+def run(n_tracks, writers, locked, secs, pause):
+    random.seed(1)
+    playlist = Playlist(DEFAULT_PLAYLIST_ID="bench")
+    tracks = [TrackInfo("Track {}".format(i), "Artist", "Album",
+                        "spotify:track:{}".format(i), 200000) for i in range(n_tracks)]
+    playlist.vote_batch([(t, random.randint(1, 20)) for t in tracks])
+
+    stop = Event()
+    latencies = []
+    batches = [0]
+
+    def read():
+        return playlist.get_tracks(PAGE_SIZE, random.randint(0, n_tracks - PAGE_SIZE))
+
+    def locked_read():
+        with playlist._lock:
+            return read()
+
+    def reader():
+        read_page = locked_read if locked else read
+        own = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            read_page()
+            own.append(time.perf_counter() - started)
+            if pause:
+                time.sleep(pause)
+        latencies.extend(own)
+
+    def writer():
+        # Votes arrive in small batches, as applied by the vote queue
+        while not stop.is_set():
+            playlist.vote_batch([(random.choice(tracks), 1)
+                                 for _ in range(VOTES_PER_BATCH)])
+            batches[0] += 1
+            time.sleep(0.001)
+
+    threads = ([Thread(target=reader) for _ in range(READERS)]
+               + [Thread(target=writer) for _ in range(writers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(secs)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return (len(latencies), latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000, batches[0])
+
+
+def main(n_tracks, secs, pause_ms):
+    print("{} tracks, {} readers of {}-track pages pausing {} ms, {}s per run".format(
+        n_tracks, READERS, PAGE_SIZE, pause_ms, secs))
+    print("{:<10}{:>8}{:>9}{:>10}{:>10}{:>14}".format(
+        "mode", "writers", "reads", "p50 ms", "p99 ms", "vote batches"))
+    for locked in (True, False):
+        for writers in (0, 1, 4):
+            reads, p50, p99, batches = run(
+                n_tracks, writers, locked, secs, pause_ms / 1000)
+            print("{:<10}{:>8}{:>9}{:>10.3f}{:>10.3f}{:>14}".format(
+                "locked" if locked else "snapshot", writers, reads, p50, p99, batches))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 3,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 0)
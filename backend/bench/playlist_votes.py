@@ -0,0 +1,91 @@
+""" Microbenchmark of voting, picking the next track and reading the top of the
+    democratic playlist with 10k tracks, compared to the list that was rebuilt on every
+    vote before the VoteIndex.
+
+    Run from the root of the repository:
+        PYTHONPATH=. python backend/bench/playlist_votes.py [tracks]
+"""
+
+import random
+import sys
+import time
+
+from backend.utils.backend_adapter import TrackInfo, track_info_2_json
+from backend.utils.democratic_playlist import DemocraticPlaylist
+
+
+class Playlist(DemocraticPlaylist):
+    def _update_default_playlist(self):
+        pass
+
+
+class ListPlaylist:
+    """ The previous implementation: a list sorted by votes, rebuilt on every vote """
+
+    def __init__(self):
+        self._track_map = {}
+        self._track_list = []
+
+    def vote(self, track_info):
+        current_votes = 0
+        track_id = track_info.id
+        if track_id in self._track_map:
+            pos = self._track_map[track_id]
+            current_votes, _ = self._track_list[pos]
+            del self._track_list[pos]
+
+        current_votes += 1
+        left = [x for x in self._track_list if x[0] < current_votes]
+        right = [x for x in self._track_list if x[0] >= current_votes]
+        self._track_list = left + [(current_votes, track_info)] + right
+        for i, (_, t_info) in enumerate(self._track_list):
+            self._track_map[t_info.id] = i
+
+    def next(self):
+        _, track_info = self._track_list.pop()
+        del self._track_map[track_info.id]
+        return track_info
+
+    def get_tracks(self, limit):
+        return {"result": [{"votes": votes, **track_info_2_json(t_info)}
+                           for votes, t_info in self._track_list[:-limit - 1:-1]]}
+
+
+def per_op_us(function, ops):
+    started = time.perf_counter()
+    for _ in range(ops):
+        function()
+    return (time.perf_counter() - started) / ops * 1e6
+
+
+def main(n_tracks):
+    random.seed(1)
+    tracks = [TrackInfo("Track {}".format(i), "Artist", "Album",
+                        "spotify:track:{}".format(i), 200000) for i in range(n_tracks)]
+
+    playlist = Playlist(DEFAULT_PLAYLIST_ID="bench")
+    # The Simple KV isn't part of the benchmark
+    playlist.kv_outbox.put = lambda *args, **kwargs: None
+    old = ListPlaylist()
+    for track in tracks:
+        votes = random.randint(1, 20)
+        playlist.vote(track, votes)
+        for _ in range(votes):
+            old.vote(track)
+
+    print("{} tracks".format(n_tracks))
+    print("{:<8}{:>14}{:>14}".format("", "list (us/op)", "index (us/op)"))
+    rows = [
+        ("vote", lambda: old.vote(random.choice(tracks)),
+         lambda: playlist.vote(random.choice(tracks)), 200),
+        ("top 50", lambda: old.get_tracks(50),
+         lambda: playlist.get_tracks(limit=50), 2000),
+        ("next", old.next, playlist.next, 200),
+    ]
+    for name, old_op, new_op, ops in rows:
+        print("{:<8}{:>14.1f}{:>14.1f}".format(
+            name, per_op_us(old_op, ops), per_op_us(new_op, ops)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,171 @@
+""" Checks the retries, Retry-After handling and coalescing of the requests sent to
+    Spotify against a local fake server that answers with storms of 429s.
+
+    Run from the root of the repository (the Spotify proxy must be configured):
+        PYTHONPATH=. python backend/bench/rate_limit_storm.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from urllib.parse import urlparse
+import json
+import sys
+import time
+
+import requests
+
+from backend.proxies.spotify.connector import HttpStats
+from backend.proxies.spotify.rate_limiter import rate_limiter
+from backend.proxies.spotify.utils import spotify_request
+
+
+class FakeSpotify(ThreadingMixIn, HTTPServer):
+    """ Answers every request with {"ok": true} unless a storm was set for its path,
+        in which case the next `count` requests to it get a 429 with the given
+        Retry-After (in seconds) """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), FakeSpotifyHandler)
+        self.lock = Lock()
+        self.storms = {}    # path -> [remaining 429s, Retry-After]
+        self.requests = {}  # path -> amount of requests received
+
+    def storm(self, path, count, retry_after):
+        with self.lock:
+            self.storms[path] = [count, retry_after]
+
+    def received(self, path):
+        with self.lock:
+            return self.requests.get(path, 0)
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = urlparse(self.path).path
+        server = self.server
+        with server.lock:
+            server.requests[path] = server.requests.get(path, 0) + 1
+            storm = server.storms.get(path)
+            throttled = storm is not None and storm[0] > 0
+            if throttled:
+                storm[0] -= 1
+
+        # Some latency so that concurrent calls overlap
+        time.sleep(0.05)
+        if throttled:
+            self.send_response(429)
+            self.send_header("Retry-After", str(storm[1]))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"ok": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class Client:
+    """ Calls the fake server through the same wrapper the SpotifyClient uses. Method
+        names match the ones of the SpotifyClient so that they get the same endpoint
+        classes """
+
+    def __init__(self, url):
+        self._url = url
+        self._session = requests.Session()
+        self._http_stats = HttpStats()
+
+    @spotify_request
+    def search(self, query):
+        return self._session.get(self._url + "/search", params={"q": query})
+
+    @spotify_request
+    def get_playlist(self, offset):
+        return self._session.get(self._url + "/playlist", params={"offset": offset})
+
+    @spotify_request
+    def add_track(self, track_id):
+        return self._session.post(self._url + "/add_track", params={"id": track_id})
+
+
+def check(name, condition, details):
+    print("{} {}: {}".format("PASS" if condition else "FAIL", name, details))
+    return condition
+
+
+def main():
+    server = FakeSpotify()
+    Thread(target=server.serve_forever, daemon=True).start()
+    client = Client("http://localhost:{}".format(server.server_address[1]))
+    rate_limiter.backoff_base = 0.05
+    ok = True
+
+    # A request rate limited twice is retried after each Retry-After and succeeds
+    server.storm("/search", 2, 1)
+    throttled = rate_limiter.throttled
+    started = time.monotonic()
+    result = client.search("retry")
+    elapsed = time.monotonic() - started
+    ok &= check("Retry-After honoured", result == {"ok": True} and elapsed >= 2,
+                "succeeded after {:.2f}s and {} throttles".format(
+                    elapsed, rate_limiter.throttled - throttled))
+
+    # Identical reads issued while their class is throttled share a single request
+    server.storm("/search", 1, 1)
+    first = Thread(target=client.search, args=("same",))
+    first.start()
+    time.sleep(0.2)  # Its 429 got the class throttled for a second
+    before = server.received("/search")
+    coalesced = rate_limiter.coalesced
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(lambda _: client.search("same"), range(10)))
+    first.join()
+    # The first call retried once and the 10 later ones shared one request
+    sent = server.received("/search") - before
+    ok &= check("Coalescing while throttled",
+                all(r == {"ok": True} for r in results) and sent <= 2,
+                "10 calls sent {} requests, {} coalesced".format(
+                    sent, rate_limiter.coalesced - coalesced))
+
+    # A storm on the playlist pages doesn't hold back adding tracks
+    server.storm("/playlist", 8, 2)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        pages = executor.map(client.get_playlist, range(0, 400, 100))
+        time.sleep(0.2)
+        started = time.monotonic()
+        client.add_track("spotify:track:1")
+        add_elapsed = time.monotonic() - started
+        list(pages)
+    ok &= check("Classes throttled independently", add_elapsed < 1,
+                "add_track took {:.2f}s during a storm on the playlist pages".format(
+                    add_elapsed))
+
+    # Endless storms give up after the configured amount of retries
+    server.storm("/search", 10 ** 6, 0)
+    before = server.received("/search")
+    try:
+        client.search("endless")
+        failed = False
+    except RuntimeError:
+        failed = True
+    ok &= check("Gives up on endless storms", failed,
+                "raised after {} requests (max attempts {})".format(
+                    server.received("/search") - before, rate_limiter.max_attempts))
+
+    print("Limiter counters: {}".format(rate_limiter.stats()))
+    server.shutdown()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
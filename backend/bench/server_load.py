@@ -0,0 +1,105 @@
+""" Load test of the backend server modes: concurrent clients polling GET /playlist
+    against the threaded server and the asyncio one, with a new connection per request
+    and with persistent connections.
+
+    Run from the root of the repository:
+        PYTHONPATH=.:backend python backend/bench/server_load.py [clients] [requests]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from threading import Thread
+import sys
+import time
+
+from backend.async_server import AsyncServer
+from backend.utils.backend_adapter import TrackInfo
+from backend.utils.democratic_playlist import DemocraticPlaylist
+import main
+
+
+class Playlist(DemocraticPlaylist):
+    def _update_default_playlist(self):
+        pass
+
+
+class BenchPlayer:
+    """ Serves the playlist without any of the components of the real Player """
+
+    def __init__(self, playlist):
+        self.playlist = playlist
+
+    def get_encoded_playlist(self, limit=None, offset=0, cursor=None):
+        return self.playlist.get_encoded_tracks(limit, offset, cursor)
+
+
+def start_server(mode, port, player):
+    # The handler picks the player up from the module
+    main.player = player
+    handler = main.getHandler(player)
+    if mode == "asyncio":
+        server = AsyncServer(("localhost", port), handler)
+    else:
+        server = main.ThreadedServer(("localhost", port), handler)
+        server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    # Wait until it accepts connections
+    for _ in range(100):
+        try:
+            HTTPConnection("localhost", port, timeout=1).connect()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("The {} server didn't start".format(mode))
+
+
+def client(port, requests, keep_alive):
+    latencies = []
+    connection = HTTPConnection("localhost", port, timeout=30)
+    for _ in range(requests):
+        started = time.perf_counter()
+        connection.request("GET", "/playlist?limit=50",
+                           headers={} if keep_alive else {"Connection": "close"})
+        response = connection.getresponse()
+        response.read()
+        if not keep_alive or response.will_close:
+            connection.close()
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+    return latencies
+
+
+def run(port, clients, requests, keep_alive):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        futures = [executor.submit(client, port, requests, keep_alive)
+                   for _ in range(clients)]
+        latencies = sorted(l for f in futures for l in f.result())
+    elapsed = time.perf_counter() - started
+    return (len(latencies) / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def main_bench(clients, requests):
+    playlist = Playlist(DEFAULT_PLAYLIST_ID="bench")
+    playlist.vote_batch([
+        (TrackInfo("Track {}".format(i), "Artist", "Album",
+                   "spotify:track:{}".format(i), 200000), i % 20 + 1)
+        for i in range(500)])
+    player = BenchPlayer(playlist)
+
+    print("{} clients x {} GET /playlist?limit=50".format(clients, requests))
+    print("{:<10}{:<13}{:>10}{:>10}{:>10}".format(
+        "server", "connections", "req/s", "p50 ms", "p99 ms"))
+    cases = [("threaded", False), ("threaded", True), ("asyncio", True)]
+    for port, (mode, keep_alive) in enumerate(cases, 18901):
+        start_server(mode, port, player)
+        rate, p50, p99 = run(port, clients, requests, keep_alive)
+        print("{:<10}{:<13}{:>10.0f}{:>10.2f}{:>10.2f}".format(
+            mode, "keep-alive" if keep_alive else "per request", rate, p50, p99))
+
+
+if __name__ == "__main__":
+    main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 32,
+               int(sys.argv[2]) if len(sys.argv) > 2 else 300)
@@ -0,0 +1,67 @@
+""" Benchmark of the tracks cache with 100k tracks, compared to the list-based cache
+    that preceded the LRU.
+
+    Run from the root of the repository (the Spotify proxy must be configured):
+        PYTHONPATH=. python backend/bench/tracks_cache.py [tracks] [limit]
+"""
+
+import random
+import sys
+import time
+
+from backend.utils.backend_adapter import TrackInfo
+from backend.proxies.spotify.tracks_cache import TracksCache, sizeof_track_info
+
+
+class ListTracksCache:
+    """ The previous cache: ids kept in a list with the newest first and never removed
+        from the dict """
+
+    def __init__(self, limit):
+        self.max_size = limit
+        self.track_id_list = []
+        self.cache = {}
+
+    def put(self, track_id, track_info):
+        if track_id in self.cache:
+            return
+        elif len(self.track_id_list) > self.max_size:
+            self.track_id_list.pop()
+        self.cache[track_id] = track_info
+        self.track_id_list.insert(0, track_id)
+
+    def get(self, track_id):
+        return self.cache.get(track_id)
+
+
+def per_op_us(function, items):
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - started) / len(items) * 1e6
+
+
+def main(n_tracks, limit):
+    random.seed(1)
+    tracks = [TrackInfo("Track {}".format(i), "Artist {}".format(i % 100), "Album",
+                        "spotify:track:{}".format(i), 200000) for i in range(n_tracks)]
+    lookups = [random.choice(tracks).id for _ in range(n_tracks)]
+    max_bytes = limit * sizeof_track_info(tracks[0])
+
+    print("{} tracks, limit {}".format(n_tracks, limit))
+    print("{:<20}{:>12}{:>12}{:>14}".format("", "put (us/op)", "get (us/op)",
+                                          "dict entries"))
+    for name, cache in [("list", ListTracksCache(limit)),
+                        ("LRU", TracksCache(limit)),
+                        ("LRU + byte bound", TracksCache(10 * limit, max_bytes))]:
+        put = per_op_us(lambda t: cache.put(t.id, t), tracks)
+        get = per_op_us(cache.get, lookups)
+        entries = len(cache.cache) if isinstance(cache, ListTracksCache) else len(cache)
+        print("{:<20}{:>12.2f}{:>12.2f}{:>14}".format(name, put, get, entries))
+        if not isinstance(cache, ListTracksCache):
+            print("    {}".format(cache.stats()))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 50000)
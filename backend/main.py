@@ -8,12 +8,20 @@ import sys
 import json
 import os
 
+from backend.async_server import AsyncServer
+from backend.utils.democratic_playlist import parse_cursor
 from backend.utils.log import get_logger
 from backend.utils.simple_kv_helpers import ping as ping_simple_kv
+from backend.utils.simple_kv_helpers import client_stats as simple_kv_client_stats
+from backend.utils.vote_queue import VoteQueueFullException
 from player import Player
 
 HOSTNAME = os.environ.get("BACKEND_HOSTNAME", "0.0.0.0")
 PORT = int(os.environ.get("BACKEND_PORT", "9001"))
+# Either "threaded" (one thread per connection) or "asyncio"
+SERVER_MODE = os.environ.get("BACKEND_SERVER_MODE", "threaded")
+# Longest time a request to /playlist_events waits for a change of the playlist
+PLAYLIST_EVENTS_TIMEOUT = float(os.environ.get("PLAYLIST_EVENTS_TIMEOUT", 25))
 
 logger = get_logger("backend")
 
@@ -89,7 +97,61 @@ def getHandler(player):
                 return
 
             if path == "/playlist":
-                response = player.get_playlist()
+                params = dict(parse_qsl(query))
+                try:
+                    limit = params.get("limit")
+                    limit = int(limit) if limit is not None else None
+                    offset = int(params.get("offset", 0))
+                    cursor = params.get("cursor")
+                    if cursor is not None:
+                        parse_cursor(cursor)
+                    if (limit is not None and limit < 0) or offset < 0:
+                        raise ValueError("Negative limit or offset")
+                except ValueError:
+                    self.send_error(400, makeError("Invalid limit, offset or cursor"))
+                    return
+                etag, content = player.get_encoded_playlist(limit, offset, cursor)
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-type", "application/json")
+                self.send_header("Content-Length", len(content))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(content)
+                return
+
+            if path == "/vote_queue":
+                response = player.get_vote_queue_stats()
+                self.output_headers()
+                self.wfile.write(json.dumps(response).encode())
+                return
+
+            if path == "/kv_outbox":
+                response = player.get_kv_outbox_stats()
+                self.output_headers()
+                self.wfile.write(json.dumps(response).encode())
+                return
+
+            if path == "/playlist_events":
+                params = dict(parse_qsl(query))
+                try:
+                    since = int(params.get("since", 0))
+                    timeout = min(float(params.get("timeout", PLAYLIST_EVENTS_TIMEOUT)),
+                                  PLAYLIST_EVENTS_TIMEOUT)
+                except ValueError:
+                    self.send_error(400, makeError("Invalid since or timeout"))
+                    return
+                response = player.get_playlist_events(since, timeout)
+                self.output_headers()
+                self.wfile.write(json.dumps(response).encode())
+                return
+
+            if path == "/simple_kv_stats":
+                response = simple_kv_client_stats()
                 self.output_headers()
                 self.wfile.write(json.dumps(response).encode())
                 return
@@ -128,8 +190,20 @@ def getHandler(player):
             if path == "/vote":
                 raw_body = self.rfile.read(
                     int(self.headers.get("Content-Length")))
-                obj = json.loads(raw_body)
-                player.vote(**obj)
+                try:
+                    obj = json.loads(raw_body)
+                    track_id = obj["track_id"]
+                except (ValueError, TypeError, KeyError):
+                    track_id = None
+                if not isinstance(track_id, str):
+                    self.send_error(400, makeError(
+                        "The body must be a JSON object with a track_id string"))
+                    return
+                try:
+                    player.vote(track_id)
+                except VoteQueueFullException:
+                    self.send_error(503, makeError("Too many pending votes"))
+                    return
                 self.send_response(204)
                 self.end_headers()
                 return
@@ -182,10 +256,14 @@ if __name__ == '__main__':
             "Registering extra endpoint handler [%s]: %s", method, endpoint)
         handlerClass.endpoints[(endpoint, method)] = handler
 
-    server = ThreadedServer((HOSTNAME, PORT), handlerClass)
+    if SERVER_MODE == "asyncio":
+        server = AsyncServer((HOSTNAME, PORT), handlerClass)
+    else:
+        server = ThreadedServer((HOSTNAME, PORT), handlerClass)
 
     try:
-        logger.debug("Starting server in address: %s:%s", HOSTNAME, PORT)
+        logger.debug("Starting %s server in address: %s:%s",
+                     SERVER_MODE, HOSTNAME, PORT)
         server.serve_forever()
     except KeyboardInterrupt:
         logger.debug("Shutting down...")
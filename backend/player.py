@@ -1,6 +1,10 @@
 """ Defines the Player class that coordinates all necessary components from the
     backend """
 from backend.controller import Controller
+from backend.utils.vote_queue import VoteQueue
+
+# How long shutting down waits for the pending changes to reach the Simple KV
+KV_OUTBOX_STOP_TIMEOUT_SECS = 5
 
 
 class Player:
@@ -10,6 +14,8 @@ class Player:
         self.proxy = proxy.get_client()
         self.controller = Controller(self.proxy)
         self.controller.start()
+        self.vote_queue = VoteQueue(self.proxy.vote_batch)
+        self.vote_queue.start()
 
     def play(self):
         """ Enqueues a PLAY event """
@@ -23,18 +29,34 @@ class Player:
         """ Forwards the filters to the searcher and returns the search result """
         return self.proxy.search(*options, **filters)
 
-    def get_playlist(self):
-        """Returns an dictionary containing the tracks from the playlist along
-           with the amount of votes each track has
-        """
-        return self.proxy.get_tracks()
+    def get_encoded_playlist(self, limit=None, offset=0, cursor=None):
+        """ Returns (ETag, JSON bytes) of a page of the playlist (the whole of it by
+            default). The ETag changes along with the playlist """
+        return self.proxy.get_encoded_tracks(limit, offset, cursor)
+
+    def get_playlist_events(self, since, timeout=None):
+        """ Returns the changes of the playlist after the given version, waiting up to
+            `timeout` seconds for them in case there's none yet """
+        return self.proxy.get_events(since, timeout)
+
+    def vote(self, track_id):
+        """ Enqueues a vote for the track with id track_id. The vote is applied
+            asynchronously along with the rest of the votes of its batch """
+        self.vote_queue.put(track_id)
+
+    def get_vote_queue_stats(self):
+        """ Returns the configuration and counters of the vote queue """
+        return self.vote_queue.stats()
 
-    def vote(self, *args, **kwargs):
-        """ Adds a vote to the track with id track_id """
-        return self.proxy.vote(*args, **kwargs)
+    def get_kv_outbox_stats(self):
+        """ Returns the configuration and counters of the outbox of the changes sent
+            to the Simple KV """
+        return self.proxy.kv_outbox.stats()
 
     def finish(self):
         """ Shuts down all components """
+        self.vote_queue.stop()
+        self.proxy.kv_outbox.stop(KV_OUTBOX_STOP_TIMEOUT_SECS)
         if hasattr(self.proxy, "finish"):
             self.proxy.finish()
 
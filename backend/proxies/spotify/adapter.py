@@ -4,7 +4,8 @@
 
 from collections import namedtuple
 
-from backend.utils.backend_adapter import BackendAdapter, TrackInfo
+from backend.utils.backend_adapter import BackendAdapter
+from backend.utils.track_registry import track_registry
 
 UserDevice = namedtuple('UserDevice', ['name', 'type', 'id', 'is_active'])
 
@@ -77,17 +78,20 @@ def get_user_devices_adapter(json_response):
 
 
 def get_playlist_tracks_adapter(json_response):
-    """ Extracts a playlist' list of tracks from the json_response and returns [TrackInfo] """
+    """ Extracts a playlist' list of tracks from the json_response and returns [TrackInfo]
+        along with the total amount of tracks in the playlist """
 
-    ret = {"result": []}
+    ret = {"result": [], "total": json_response.get('total', 0)}
     for item in json_response['items']:
-        ret["result"].append(json_to_track_info(item["track"]))
+        # Tracks that are no longer available come as null
+        if item["track"]:
+            ret["result"].append(json_to_track_info(item["track"]))
     return ret
 
 
 def get_track_adapter(json):
     """ Extracts a TrackInfo from json """
-    return TrackInfo(
+    return track_registry.intern(
         json['name'],                       # Track name
         json['artists'][0]['name'],         # Artist
         json['album']['name'],              # Album name
@@ -95,8 +99,15 @@ def get_track_adapter(json):
         int(json['duration_ms']) / 1000)    # Track length in seconds
 
 
+def get_several_tracks_adapter(json):
+    """ Extracts [TrackInfo] from json. Unknown tracks are mapped to None """
+    return [get_track_adapter(track) if track else None
+            for track in json['tracks']]
+
+
 backend_adapter = BackendAdapter()
 backend_adapter.adapter_registry['search'] = search_adapter
 backend_adapter.adapter_registry['get_user_devices'] = get_user_devices_adapter
 backend_adapter.adapter_registry['get_playlist'] = get_playlist_tracks_adapter
 backend_adapter.adapter_registry['get_track'] = get_track_adapter
+backend_adapter.adapter_registry['get_several_tracks'] = get_several_tracks_adapter
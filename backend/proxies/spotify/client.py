@@ -1,24 +1,30 @@
 """ Class containing a high-level client of Spotify's API intended to be
     used by the player """
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from urllib.parse import urlencode, quote
+import re
 import threading
-import time
-import requests
 
 from backend.utils.democratic_playlist import DemocraticPlaylist
 from backend.utils.log import get_logger
-from backend.utils.backend_adapter import TrackInfo
+from backend.utils.track_registry import track_registry
 import backend.controller as Controller
 
 from .adapter import backend_adapter
-from .constants import API_URL, AUTH_TOKEN_FMT
+from .constants import (API_URL, AUTH_TOKEN_FMT, PLAYLIST_PAGE_SIZE,
+                        DEFAULT_PLAYLIST_FETCH_WORKERS, TRACK_URI_PATTERN)
+from .search_cache import search_cache
+from .track_batcher import TrackLookupBatcher
+from .poller import PlayerStatePoller
 from .tracks_cache import tracks_cache
 from .utils import spotify_request, gen_playlist_name
 from .connector import SpotifyConnector
 
 logger = get_logger("backend")
 
+_track_uri_re = re.compile(TRACK_URI_PATTERN)
+
 
 class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
     """ Derived class implementing the calls to the API. The splitting
@@ -37,22 +43,24 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         super().__init__(**config)
 
         # self._default_playlist_id = app.config.get('spotify_default_playlist_id, '')
-        self.running = True
-        self.state_checking_thread = None
         self.is_playing = threading.Event()
+        self._waiting_for_playback = False
+        # Shared by every component interested in the state of the Spotify player
+        self.player_state_poller = PlayerStatePoller(self.get_player_info)
+        self.player_state_poller.start()
+        self._track_batcher = TrackLookupBatcher(self._fetch_tracks)
 
     def initialize(self, controller: Controller.Controller):
         """
             Idempotent function that: creates a new playlist in Spotify in case there's
-            none, lauches a thread that polls the state of the Spotify player until
-            is playing and then synchronizes the state of the Controller to match that.
+            none, subscribes to the state of the Spotify player until it is playing
+            and then synchronizes the state of the Controller to match that.
             Returns `True` if initialization was properly performed and `False` otherwise.
             It is part of an ugly hack to (try to) overcome Spotify's API limitations
             described in https://github.com/spotify/web-api/issues/462
         """
 
         if self.is_playing.is_set():
-            self.state_checking_thread.join(1.0)
             return {"is_playing": True}
 
         # Create and populate a playlist in Spotify and adjust the controller's internal state
@@ -64,66 +72,72 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
             controller._remaining_in_secs = next_track.length - 5
             controller._state = Controller.STATE_PAUSED
 
-        if not self.state_checking_thread:
-            def state_checker(client: SpotifyClient,
-                              controller: Controller.Controller):
-                """Function used by the thread that checks the state of the player"""
-                while client.running:
-                    player_info = client.get_player_info()
-                    if player_info['is_playing']:
-                        client.is_playing.set()
-                        controller.queue.put(Controller.PLAY)
-                        logger.debug(
-                            "Spotify player is playing. Nothing else to do for the state "
-                            "checking thread. Over and out !")
-                        break
-
-            # Launch the thread and give it some time to initialize
-            self.state_checking_thread = threading.Thread(
-                target=state_checker, args=(self, controller))
-            self.state_checking_thread.start()
-            time.sleep(2)
-
-        return {"is_playing": False}
+        if not self._waiting_for_playback:
+            def on_player_state_change(old_info, new_info):
+                """Synchronizes the Controller once the Spotify player starts playing"""
+                if (new_info and new_info.get('is_playing')
+                        and not self.is_playing.is_set()):
+                    self.player_state_poller.unsubscribe(on_player_state_change)
+                    self.is_playing.set()
+                    controller.queue.put(Controller.PLAY)
+                    logger.debug("Spotify player is playing. The controller takes "
+                                 "it from here")
+
+            self._waiting_for_playback = True
+            self.player_state_poller.subscribe(on_player_state_change)
+
+        # Give the poller some time to find out whether it's already playing
+        return {"is_playing": self.is_playing.wait(2)}
 
     def finish(self):
         """ Stop following the playlist at exit to avoid polluting the client's profile """
 
-        self.running = False
-        num_tries = 0
-        while self.state_checking_thread and self.state_checking_thread.is_alive():
-            if num_tries >= 5:
-                logger.info(
-                    "Couldn't join the state checking thread after 5 tries."
-                    "Will leave anyway")
-                break
-            self.state_checking_thread.join(1.0)
-            num_tries += 1
-
+        self.player_state_poller.stop()
         self.unfollow_playlist()
         SpotifyConnector.finish(self)
 
     def _update_default_playlist(self):
-        """ Override method from the DemocraticPlaylist """
+        """ Override method from the DemocraticPlaylist. Fetches all the pages of the
+            default playlist, the ones after the first concurrently """
 
         # This filter gets us all the information we need for our use case.
         # For more info check:
         # https://beta.developer.spotify.com/documentation/web-api/reference/playlists/get-playlists-tracks/
-        query_filter = 'items(track(album, artists, duration_ms, name, id, uri))'
-        default_playlist = self.get_playlist(
-            self._default_playlist_id, fields=query_filter)["result"]
-
-        self._default_track_set = set([
-            TrackInfo(
+        query_filter = ('total,items(track(album(name), artists(name), duration_ms, '
+                        'name, uri))')
+
+        def get_page(offset):
+            return self.get_playlist(
+                self._default_playlist_id, fields=query_filter, offset=offset,
+                limit=PLAYLIST_PAGE_SIZE)
+
+        first_page = get_page(0)
+        default_playlist = first_page["result"]
+        offsets = range(PLAYLIST_PAGE_SIZE, first_page["total"], PLAYLIST_PAGE_SIZE)
+        if offsets:
+            with ThreadPoolExecutor(
+                    max_workers=DEFAULT_PLAYLIST_FETCH_WORKERS) as executor:
+                for page in executor.map(get_page, offsets):
+                    default_playlist.extend(page["result"])
+
+        default_track_set = set([
+            track_registry.intern(
                 t["name"],
                 t["artist"],
                 t["album"],
                 t["id"],
                 t["length"])
             for t in default_playlist])
-        # logger.debug("Default playlist: %s", self._default_track_set)
+        logger.debug("Fetched %s tracks from the default playlist",
+                     len(default_track_set))
 
-    # @tracks_cache.cache_results
+        with self._lock:
+            # Tracks voted since they were fetched belong to the democratic playlist
+            self._default_track_set = set(
+                t for t in default_track_set if t.id not in self._vote_index)
+
+    @tracks_cache.cache_results
+    @search_cache.cache_results
     @backend_adapter.register
     @spotify_request
     def search(self, limit=1, item_type=None, **filters):
@@ -154,9 +168,9 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         payload['type'] = item_type
         payload['limit'] = limit
 
-        return requests.get(url=API_URL + 'search',
-                            params=urlencode(payload, quote_via=quote),
-                            headers={'Authorization':
+        return self._session.get(url=API_URL + 'search',
+                                 params=urlencode(payload, quote_via=quote),
+                                 headers={'Authorization':
                                      AUTH_TOKEN_FMT.format(self._access_token)})
 
     @spotify_request
@@ -165,9 +179,9 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         Send play to Spotify
         """
 
-        return requests.put(url=API_URL + 'me/player/play',
-                            json=kwargs if len(kwargs) else None,
-                            headers={'Authorization':
+        return self._session.put(url=API_URL + 'me/player/play',
+                                 json=kwargs if len(kwargs) else None,
+                                 headers={'Authorization':
                                      AUTH_TOKEN_FMT.format(self._access_token)})
 
     @spotify_request
@@ -176,8 +190,8 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         Send pause to Spotify
         """
 
-        return requests.put(url=API_URL + 'me/player/pause',
-                            headers={'Authorization':
+        return self._session.put(url=API_URL + 'me/player/pause',
+                                 headers={'Authorization':
                                      AUTH_TOKEN_FMT.format(self._access_token)})
 
     @spotify_request
@@ -195,7 +209,7 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         if description:
             payload['description'] = description
 
-        return requests.post(
+        return self._session.post(
             url=endpoint, json=payload,
             headers={'Authorization': AUTH_TOKEN_FMT.format(
                 self._access_token)})
@@ -215,7 +229,7 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         payload = {}
         payload['uris'] = [track_id]  # XXX this does not handle multiple tracks
 
-        return requests.post(
+        return self._session.post(
             url=endpoint, json=payload,
             headers={'Authorization': AUTH_TOKEN_FMT.format(
                 self._access_token)})
@@ -227,8 +241,8 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
 
         endpoint = '{api_url}me/player/devices'.format(api_url=API_URL)
 
-        return requests.get(url=endpoint,
-                            headers={'Authorization':
+        return self._session.get(url=endpoint,
+                                 headers={'Authorization':
                                      AUTH_TOKEN_FMT.format(self._access_token)})
 
     @spotify_request
@@ -238,9 +252,9 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         endpoint = '{api_url}me/player'.format(api_url=API_URL)
         payload = {'device_ids': [device_id]}
 
-        return requests.put(url=endpoint,
-                            json=payload,
-                            headers={'Authorization':
+        return self._session.put(url=endpoint,
+                                 json=payload,
+                                 headers={'Authorization':
                                      AUTH_TOKEN_FMT.format(self._access_token)})
 
     @spotify_request
@@ -251,14 +265,14 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         endpoint = '{}playlists/{}/followers'.format(API_URL,
                                                      self.playlist_id)
 
-        return requests.delete(
+        return self._session.delete(
             url=endpoint,
             headers={'Authorization': AUTH_TOKEN_FMT.format(
                 self._access_token)})
 
     @backend_adapter.register
     @spotify_request
-    def get_playlist(self, playlist_id, fields, offset=0):
+    def get_playlist(self, playlist_id, fields, offset=0, limit=PLAYLIST_PAGE_SIZE):
         """ Retrieves a list of tracks from a particular Spotify playlist """
 
         endpoint = '{api_url}playlists/{playlist_id}/tracks'.format(
@@ -267,11 +281,12 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         payload = {}
         payload['fields'] = fields
         payload['offset'] = offset
+        payload['limit'] = limit
         payload['market'] = 'from_token'
 
-        return requests.get(url=endpoint,
-                            params=urlencode(payload, quote_via=quote),
-                            headers={'Authorization':
+        return self._session.get(url=endpoint,
+                                 params=urlencode(payload, quote_via=quote),
+                                 headers={'Authorization':
                                      AUTH_TOKEN_FMT.format(self._access_token)})
 
     @backend_adapter.register
@@ -283,30 +298,92 @@ class SpotifyClient(SpotifyConnector, DemocraticPlaylist):
         endpoint = '{api_url}tracks/{track_id}'.format(
             api_url=API_URL, track_id=track_id)
 
-        return requests.get(
+        return self._session.get(
             url=endpoint,
             headers={'Authorization': AUTH_TOKEN_FMT.format(
                 self._access_token)})
 
+    @backend_adapter.register
+    @spotify_request
+    def get_several_tracks(self, track_uris):
+        """ Gets the track_info of each of the given track_uris (up to 50) """
+
+        payload = {}
+        # No market: it lets Spotify relink the tracks and answer with another URI
+        # than the one that was voted
+        payload['ids'] = ','.join(uri.split(":")[-1] for uri in track_uris)
+
+        return self._session.get(
+            url='{api_url}tracks'.format(api_url=API_URL),
+            params=urlencode(payload),
+            headers={'Authorization': AUTH_TOKEN_FMT.format(
+                self._access_token)})
+
     @spotify_request
     def get_player_info(self):
         """ Gets the current playing context """
 
-        return requests.get(
+        return self._session.get(
             url='{api_url}me/player'.format(api_url=API_URL),
             headers={'Authorization': AUTH_TOKEN_FMT.format(
                 self._access_token)})
 
-    def vote(self, **kwargs):
-        """ Override of the method from the DemocraticPlaylist to get the track info based on the
-            ID of the track being voted """
-
-        track_uri = kwargs["track_id"]
-        track_info = None
-        if track_uri in tracks_cache:
-            track_info = tracks_cache[track_uri]
-        else:
-            track_info = self.get_track(track_uri)
-            logger.debug("Will vote track with info: %s", track_info)
-        # Call the method from the base class
-        DemocraticPlaylist.vote(self, track_info)
+    def get_http_stats(self, controller=None):
+        """ Extends the stats from the connector with the ones of the poller """
+
+        stats = SpotifyConnector.get_http_stats(self)
+        stats["player_state_poller"] = self.player_state_poller.stats()
+        return stats
+
+    def get_cache_stats(self, controller=None):
+        """ Returns the counters of the caches used by the client """
+
+        return {"search": search_cache.stats(),
+                "tracks": tracks_cache.stats(),
+                "track_lookups": self._track_batcher.stats()}
+
+    def _get_track_info_future(self, track_uri):
+        """ Returns a Future for the TrackInfo of the given track. Tracks that are not
+            cached are fetched from Spotify along with the other concurrent misses """
+
+        track_info = tracks_cache.get(track_uri)
+        if track_info is not None:
+            future = Future()
+            future.set_result(track_info)
+            return future
+
+        if not _track_uri_re.fullmatch(track_uri):
+            # Kept out of the batch so that it doesn't fail the rest of the lookups
+            future = Future()
+            future.set_exception(
+                RuntimeError('Invalid track URI {!r}'.format(track_uri)))
+            return future
+
+        return self._track_batcher.submit(track_uri)
+
+    def _fetch_tracks(self, track_uris):
+        """ Used by the track batcher to fetch a batch of tracks and cache them """
+
+        track_infos = self.get_several_tracks(track_uris)
+        for track_uri, track_info in zip(track_uris, track_infos):
+            if track_info is not None:
+                tracks_cache.put(track_uri, track_info)
+        return track_infos
+
+    def vote_batch(self, votes):
+        """ Override of the method from the DemocraticPlaylist. Takes {track_uri: votes},
+            gets the info of the tracks without holding the playlist's lock and then
+            applies all the votes at once """
+
+        # Submit all the lookups first so that the misses end up in the same batch
+        futures = [(track_uri, track_votes_count, self._get_track_info_future(track_uri))
+                   for track_uri, track_votes_count in votes.items()]
+
+        track_votes = []
+        for track_uri, track_votes_count, future in futures:
+            try:
+                track_votes.append((future.result(), track_votes_count))
+            except RuntimeError as exc:
+                logger.error("Dropping %s vote(s) for track %s: %s",
+                             track_votes_count, track_uri, exc)
+        DemocraticPlaylist.vote_batch(self, track_votes)
@@ -6,12 +6,40 @@ import base64
 import threading
 import requests
 
-from .constants import AUTH_URL, CALLBACK_ENDPOINT, TOKEN_URL
+from .constants import AUTH_URL, CALLBACK_ENDPOINT, TOKEN_URL, HTTP_POOL_SIZE
+from .rate_limiter import rate_limiter
 
 
 REFRESH_CONDITION = threading.Condition()  # Uses an RLock by default
 
 
+class HttpStats:
+    """ Thread-safe accumulator of the latency of the calls made to Spotify """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # name -> [count, total_ms, max_ms]
+
+    def record(self, name, elapsed_ms):
+        """ Accounts a call to `name` that took `elapsed_ms` milliseconds """
+
+        with self._lock:
+            stats = self._calls.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed_ms
+            stats[2] = max(stats[2], elapsed_ms)
+
+    def latencies(self):
+        """ Returns {name: {count, avg_ms, max_ms}} """
+
+        with self._lock:
+            return {
+                name: {"count": count,
+                       "avg_ms": round(total_ms / count, 3),
+                       "max_ms": round(max_ms, 3)}
+                for name, (count, total_ms, max_ms) in self._calls.items()}
+
+
 class SpotifyConnector:
     """ Class that handles the authentication against Spotify and the
         automatic refresh of the access token
@@ -41,6 +69,14 @@ class SpotifyConnector:
         self._refresh_thread = None
         self._refresh_thread_running = False
 
+        # Session shared by every thread talking to Spotify so that the TCP+TLS
+        # connections are kept alive and reused across calls
+        pool_size = config.get('http_pool_size', HTTP_POOL_SIZE)
+        self._session = requests.Session()
+        self._session.mount('https://', requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size))
+        self._http_stats = HttpStats()
+
     def start_login(self, controller=None,
                     scope=('user-modify-playback-state',
                            'playlist-modify-private',
@@ -99,7 +135,7 @@ class SpotifyConnector:
                 request_data['redirect_uri'] = CALLBACK_ENDPOINT
                 request_data['client_id'] = self.client_id
                 request_data['client_secret'] = self.client_secret
-                r = requests.post(url=TOKEN_URL, data=request_data)
+                r = self._session.post(url=TOKEN_URL, data=request_data)
             else:
                 request_data['grant_type'] = 'refresh_token'
                 request_data['refresh_token'] = self._refresh_token
@@ -107,7 +143,7 @@ class SpotifyConnector:
                     self.client_id, self.client_secret)
                 headers = {'Authorization': 'Basic {}'.format(
                     base64.b64encode(client_id_secret.encode()).decode())}
-                r = requests.post(
+                r = self._session.post(
                     url=TOKEN_URL, headers=headers, data=request_data)
 
             r.raise_for_status()
@@ -141,6 +177,28 @@ class SpotifyConnector:
             self.refresh_token(False)
             REFRESH_CONDITION.release()
 
+    def get_http_stats(self, controller=None):
+        """ Returns the latency of the calls made to Spotify along with the amount of
+            requests and of connections opened to serve them """
+
+        num_requests = 0
+        num_connections = 0
+        pools = self._session.get_adapter('https://').poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+
+        return {
+            "requests": num_requests,
+            "connections": num_connections,
+            "reuse_rate": (round(1 - num_connections / num_requests, 3)
+                           if num_requests else None),
+            "latency": self._http_stats.latencies(),
+            "rate_limiting": rate_limiter.stats(),
+        }
+
     def finish(self):
         """
         Clean-up: notify the refresh worker, make it exit and join it
@@ -159,3 +217,5 @@ class SpotifyConnector:
                 # logger.warning(
                 #     'During clean-up: Spotify token-refresh thread marked as '
                 #     'running but not alive. Will mark it as not running')
+
+        self._session.close()
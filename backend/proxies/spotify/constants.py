@@ -1,8 +1,47 @@
 """ Spotify-related constants used in different modules """
 
+import os
+
 CALLBACK_ENDPOINT='http://127.0.0.1:5000/callback'
 AUTH_URL = 'https://accounts.spotify.com/authorize'
 TOKEN_URL = 'https://accounts.spotify.com/api/token'
 API_URL = 'https://api.spotify.com/v1/'
 
 AUTH_TOKEN_FMT='Bearer {}'
+
+# Amount of connections kept alive towards each Spotify host
+HTTP_POOL_SIZE = int(os.environ.get('SPOTIFY_HTTP_POOL_SIZE', 10))
+
+# Bounds of the cache of search results
+SEARCH_CACHE_SIZE = int(os.environ.get('SPOTIFY_SEARCH_CACHE_SIZE', 500))
+SEARCH_CACHE_TTL = float(os.environ.get('SPOTIFY_SEARCH_CACHE_TTL', 600))
+
+# Bounds of the cache of tracks info. The size in bytes is only enforced if it's set
+TRACKS_CACHE_SIZE = int(os.environ.get('SPOTIFY_TRACKS_CACHE_SIZE', 1000))
+TRACKS_CACHE_MAX_BYTES = (int(os.environ['SPOTIFY_TRACKS_CACHE_MAX_BYTES'])
+                          if 'SPOTIFY_TRACKS_CACHE_MAX_BYTES' in os.environ else None)
+
+# Lookups of tracks issued within the window are fetched in a single request.
+# 50 is the maximum amount of tracks Spotify accepts per request
+TRACK_BATCH_WINDOW_MS = int(os.environ.get('SPOTIFY_TRACK_BATCH_WINDOW_MS', 20))
+TRACK_BATCH_MAX_SIZE = 50
+# Shape of the URIs of the tracks. Spotify rejects the whole batch if any isn't valid
+TRACK_URI_PATTERN = r'spotify:track:[0-9A-Za-z]+'
+
+# Spotify returns up to 100 tracks per page of a playlist
+PLAYLIST_PAGE_SIZE = 100
+DEFAULT_PLAYLIST_FETCH_WORKERS = int(
+    os.environ.get('SPOTIFY_DEFAULT_PLAYLIST_FETCH_WORKERS', 4))
+
+# Client-side pacing of the requests of each endpoint class (search, player, ...)
+RATE_LIMIT_PER_SEC = float(os.environ.get('SPOTIFY_RATE_LIMIT_PER_SEC', 10))
+RATE_LIMIT_BURST = int(os.environ.get('SPOTIFY_RATE_LIMIT_BURST', 20))
+# Retries of the requests that get rate limited (429) or hit a transient error (5xx)
+RETRY_MAX_ATTEMPTS = int(os.environ.get('SPOTIFY_RETRY_MAX_ATTEMPTS', 4))
+RETRY_BACKOFF_BASE_SECS = float(os.environ.get('SPOTIFY_RETRY_BACKOFF_BASE_SECS', 0.5))
+RETRY_BACKOFF_MAX_SECS = float(os.environ.get('SPOTIFY_RETRY_BACKOFF_MAX_SECS', 30))
+
+# Bounds of the interval used to poll the state of the player
+POLL_MIN_INTERVAL_SECS = float(os.environ.get('SPOTIFY_POLL_MIN_INTERVAL_SECS', 1))
+POLL_MAX_INTERVAL_SECS = float(os.environ.get('SPOTIFY_POLL_MAX_INTERVAL_SECS', 10))
+POLL_MAX_BACKOFF_SECS = float(os.environ.get('SPOTIFY_POLL_MAX_BACKOFF_SECS', 60))
@@ -35,8 +35,24 @@ def initialize_handler(httpHandler: BaseHTTPRequestHandler):
     httpHandler.wfile.write(json.dumps(response).encode())
 
 
+def http_stats_handler(httpHandler: BaseHTTPRequestHandler):
+    """Used to report the stats of the connections and calls to Spotify"""
+    response = httpHandler.player.get_http_stats()
+    httpHandler.output_headers()
+    httpHandler.wfile.write(json.dumps(response).encode())
+
+
+def cache_stats_handler(httpHandler: BaseHTTPRequestHandler):
+    """Used to report the hits and misses of the caches of the client"""
+    response = httpHandler.player.get_cache_stats()
+    httpHandler.output_headers()
+    httpHandler.wfile.write(json.dumps(response).encode())
+
+
 EXTRA_ENDPOINTS = [
     ("/start_login", "GET", start_login_handler, SpotifyClient.start_login),
     ("/complete_login", "GET", complete_login_handler, SpotifyClient.complete_login),
     ("/initialize", "GET", initialize_handler, SpotifyClient.initialize),
+    ("/http_stats", "GET", http_stats_handler, SpotifyClient.get_http_stats),
+    ("/cache_stats", "GET", cache_stats_handler, SpotifyClient.get_cache_stats),
 ]
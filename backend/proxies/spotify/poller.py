@@ -0,0 +1,132 @@
+""" Defines the thread that polls the state of the Spotify player on behalf of any
+    component interested in its changes """
+
+from threading import Thread, Event, Lock
+import time
+
+from backend.utils.log import get_logger
+
+from .constants import (POLL_MIN_INTERVAL_SECS, POLL_MAX_INTERVAL_SECS,
+                        POLL_MAX_BACKOFF_SECS)
+
+logger = get_logger("backend")
+
+# Not every platform provides a per-thread CPU clock
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+
+def player_state_key(player_info):
+    """ Returns the part of the player info whose changes are notified """
+
+    if not player_info:
+        return None
+    return (player_info.get('is_playing'),
+            (player_info.get('item') or {}).get('uri'),
+            (player_info.get('device') or {}).get('id'))
+
+
+class PlayerStatePoller(Thread):
+    """ Polls `get_player_info` while there are subscribers and calls each one of them
+        with (old_info, new_info) whenever the state of the player changes. The
+        interval grows from `min_interval` up to `max_interval` while the state stays
+        the same and goes back to `min_interval` after a change. Failed calls back off
+        exponentially up to `max_backoff` """
+
+    def __init__(self, get_player_info,
+                 min_interval=POLL_MIN_INTERVAL_SECS,
+                 max_interval=POLL_MAX_INTERVAL_SECS,
+                 max_backoff=POLL_MAX_BACKOFF_SECS):
+        super().__init__(daemon=True)
+
+        self._get_player_info = get_player_info
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+
+        self._subscribers = []
+        self._lock = Lock()
+        self._has_subscribers = Event()
+        self._stopped = Event()
+        self._last_info = None
+
+        self.calls = 0
+        self.errors = 0
+        self.cpu_time = 0.0
+
+    def subscribe(self, callback):
+        """ Registers a callback that gets (old_info, new_info) on every change. It's
+            called right away in case there's already a known state """
+
+        with self._lock:
+            self._subscribers.append(callback)
+            self._has_subscribers.set()
+            last_info = self._last_info
+        if last_info is not None:
+            callback(None, last_info)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+            if not self._subscribers:
+                self._has_subscribers.clear()
+
+    def stop(self):
+        """ Makes the thread exit and logs how much it cost """
+
+        self._stopped.set()
+        self._has_subscribers.set()  # Wake the thread up in case it's idle
+        if self.is_alive():
+            self.join()
+        logger.info("Player state poller stopped after %s calls (%s errors) "
+                    "using %.3fs of CPU", self.calls, self.errors, self.cpu_time)
+
+    def run(self):
+        interval = self.min_interval
+        backoff = self.min_interval
+        while not self._stopped.is_set():
+            # Nobody is interested: don't poll
+            self._has_subscribers.wait()
+            if self._stopped.is_set():
+                break
+
+            cpu_started = _cpu_time()
+            try:
+                self.calls += 1
+                player_info = self._get_player_info()
+            except RuntimeError as exc:
+                self.errors += 1
+                logger.debug("Polling the player failed: %s. Retrying in %.1fs",
+                             exc, backoff)
+                self.cpu_time += _cpu_time() - cpu_started
+                self._stopped.wait(backoff)
+                backoff = min(self.max_backoff, backoff * 2)
+                continue
+            backoff = self.min_interval
+
+            if player_state_key(player_info) != player_state_key(self._last_info):
+                old_info, self._last_info = self._last_info, player_info
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                for callback in subscribers:
+                    try:
+                        callback(old_info, player_info)
+                    except Exception as exc:
+                        logger.error("Player state subscriber failed: %s", exc)
+                interval = self.min_interval
+            else:
+                self._last_info = player_info
+                interval = min(self.max_interval, interval * 1.5)
+            self.cpu_time += _cpu_time() - cpu_started
+
+            if self.calls % 100 == 0:
+                logger.debug("Player state poller: %s calls (%s errors), %.3fs of CPU",
+                             self.calls, self.errors, self.cpu_time)
+            self._stopped.wait(interval)
+
+    def stats(self):
+        """ Returns the counters of the poller """
+
+        return {"calls": self.calls,
+                "errors": self.errors,
+                "cpu_time_secs": round(self.cpu_time, 3)}
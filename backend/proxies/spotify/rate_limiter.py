@@ -0,0 +1,159 @@
+""" Client-side rate limiting of the requests sent to Spotify. Requests are grouped in
+    endpoint classes, each one with its own token bucket, and a class is held back as
+    a whole while Spotify asks us to slow down (429 + Retry-After) """
+
+from concurrent.futures import Future
+from threading import Lock
+import random
+import time
+
+from .constants import (RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST, RETRY_MAX_ATTEMPTS,
+                        RETRY_BACKOFF_BASE_SECS, RETRY_BACKOFF_MAX_SECS)
+
+# Endpoint class of each of the SpotifyClient methods. Missing ones are 'default'
+ENDPOINT_CLASSES = {
+    'search': 'search',
+    'play': 'player',
+    'pause': 'player',
+    'get_player_info': 'player',
+    'get_user_devices': 'player',
+    'set_user_device': 'player',
+    'get_track': 'tracks',
+    'get_several_tracks': 'tracks',
+    # Refreshing the default playlist reads lots of pages at once. They get their own
+    # class so that they don't hold back adding the next track to the playlist
+    'get_playlist': 'playlists',
+}
+
+# Methods that only read from Spotify. Identical concurrent calls to them can share
+# a single request while their endpoint class is throttled
+READ_ONLY_METHODS = {
+    'search', 'get_player_info', 'get_user_devices', 'get_track',
+    'get_several_tracks', 'get_playlist',
+}
+
+
+class TokenBucket:
+    """ Thread-safe token bucket refilled at `rate` tokens per second and holding up
+        to `capacity` tokens """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """ Takes a token, sleeping until there's one available """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """ Paces the requests of every endpoint class and keeps track of the classes that
+        Spotify throttled """
+
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, burst=RATE_LIMIT_BURST,
+                 max_attempts=RETRY_MAX_ATTEMPTS,
+                 backoff_base=RETRY_BACKOFF_BASE_SECS,
+                 backoff_max=RETRY_BACKOFF_MAX_SECS):
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = Lock()
+        self._buckets = {}          # endpoint class -> TokenBucket
+        self._throttled_until = {}  # endpoint class -> monotonic timestamp
+        self._in_flight = {}        # call key -> Future
+
+        self.throttled = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    def wait(self, endpoint_class):
+        """ Blocks until a request of the given endpoint class can be sent """
+
+        with self._lock:
+            bucket = self._buckets.get(endpoint_class)
+            if bucket is None:
+                bucket = self._buckets[endpoint_class] = TokenBucket(
+                    self.rate, self.burst)
+            throttled_until = self._throttled_until.get(endpoint_class, 0)
+
+        delay = throttled_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        bucket.acquire()
+
+    def is_throttled(self, endpoint_class):
+        return self._throttled_until.get(endpoint_class, 0) > time.monotonic()
+
+    def throttle(self, endpoint_class, delay):
+        """ Holds back every request of the endpoint class for `delay` seconds """
+
+        with self._lock:
+            self.throttled += 1
+            self._throttled_until[endpoint_class] = max(
+                self._throttled_until.get(endpoint_class, 0),
+                time.monotonic() + delay)
+
+    def backoff(self, attempt, retry_after=None):
+        """ Returns how long to wait before the given retry. Honours the Retry-After
+            header (in seconds) if it's present and adds jitter otherwise """
+
+        self.retries += 1
+        if retry_after is not None:
+            try:
+                return float(retry_after) + random.uniform(0, self.backoff_base)
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def coalesce(self, key, call):
+        """ Runs `call` unless there's already a call with the same key in flight, in
+            which case its result is shared """
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(call())
+        except Exception as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def stats(self):
+        """ Returns the counters of the limiter """
+
+        return {"throttled": self.throttled,
+                "retries": self.retries,
+                "coalesced": self.coalesced}
+
+
+rate_limiter = RateLimiter()
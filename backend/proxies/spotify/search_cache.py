@@ -0,0 +1,46 @@
+""" Defines a cache for the results of 'search'. Like the tracks cache, it's used as a
+    singleton and is an implementation detail of the Spotify client """
+
+from functools import wraps
+
+from backend.utils.lru_cache import LRUCache
+
+from .constants import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+
+
+class SearchCache(LRUCache):
+    """ LRU cache with TTL whose keys are the normalized parameters of a search """
+
+    @staticmethod
+    def make_key(limit=1, item_type=None, **filters):
+        """ Returns a key that is the same for searches that would be sent to
+            Spotify with the same query """
+
+        item_type = (item_type or 'track').lower()
+        if item_type not in ['track', 'artist', 'album']:
+            item_type = 'track'
+
+        return (tuple(sorted(
+            (name, ' '.join(value.lower().split()))
+            for name, value in filters.items() if value and value.strip())),
+                item_type,
+                int(limit))
+
+    def cache_results(self, function):
+        """ Returns the cached result of the wrapped search in case there's one and
+            caches it otherwise """
+
+        @wraps(function)
+        def wrapper(client, limit=1, item_type=None, **filters):
+            key = self.make_key(limit, item_type, **filters)
+            result = self.get(key)
+            if result is None:
+                result = function(client, limit=limit, item_type=item_type,
+                                  **filters)
+                self.put(key, result)
+            return result
+
+        return wrapper
+
+
+search_cache = SearchCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
@@ -0,0 +1,115 @@
+""" Defines a batcher that groups the lookups of track infos issued concurrently into
+    a single request to Spotify's multi-track endpoint """
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock, Timer
+
+from .constants import TRACK_BATCH_WINDOW_MS, TRACK_BATCH_MAX_SIZE
+
+
+def _is_bad_request(exc):
+    """ Whether the exception was caused by a 400 response """
+
+    while exc is not None:
+        response = getattr(exc, "response", None)
+        if response is not None:
+            return response.status_code == 400
+        exc = exc.__cause__
+    return False
+
+
+class TrackLookupBatcher:
+    """ Collects the track URIs submitted within `window_ms` (or until `max_size` of
+        them are pending) and fetches them all at once with `fetch`, which takes a
+        list of URIs and returns the list of their TrackInfo (None for unknown ones).
+        Every submitter gets a Future that's resolved with the info of its track """
+
+    def __init__(self, fetch, window_ms=TRACK_BATCH_WINDOW_MS,
+                 max_size=TRACK_BATCH_MAX_SIZE):
+        self._fetch = fetch
+        self.window_ms = window_ms
+        self.max_size = max_size
+        self._lock = Lock()
+        self._pending = OrderedDict()  # track_uri -> Future
+        self._timer = None
+
+        self.requests = 0
+        self.lookups = 0
+
+    def submit(self, track_uri):
+        """ Returns a Future for the TrackInfo of the given track """
+
+        batch = None
+        with self._lock:
+            self.lookups += 1
+            future = self._pending.get(track_uri)
+            if future is not None:
+                return future
+
+            future = self._pending[track_uri] = Future()
+            if len(self._pending) >= self.max_size:
+                batch = self._take_pending()
+            elif self._timer is None:
+                self._timer = Timer(self.window_ms / 1000, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        # A full batch is fetched right away by the thread that completed it
+        if batch is not None:
+            self._run(batch)
+        return future
+
+    def lookup(self, track_uri):
+        """ Returns the TrackInfo of the given track, waiting for its batch """
+
+        return self.submit(track_uri).result()
+
+    def _take_pending(self):
+        """ Detaches the pending batch. Must be called with the lock held """
+
+        batch = self._pending
+        self._pending = OrderedDict()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch):
+        """ Fetches the tracks of the batch and fans the results out to the futures.
+            In case Spotify rejects the request as a bad one the batch is split in
+            halves and each one of them is fetched on its own, so that a single bad
+            URI only fails its own lookup. Any other failure (rate limiting, server
+            errors, timeouts) fails the whole batch at once """
+
+        self.requests += 1
+        try:
+            track_infos = self._fetch(list(batch))
+        except Exception as exc:
+            if len(batch) == 1 or not _is_bad_request(exc):
+                for future in batch.values():
+                    future.set_exception(exc)
+                return
+            items = list(batch.items())
+            middle = len(items) // 2
+            self._run(OrderedDict(items[:middle]))
+            self._run(OrderedDict(items[middle:]))
+            return
+
+        for (track_uri, future), track_info in zip(batch.items(), track_infos):
+            if track_info is None:
+                future.set_exception(
+                    RuntimeError('Track {} not found'.format(track_uri)))
+            else:
+                future.set_result(track_info)
+
+    def stats(self):
+        """ Returns the amount of lookups and of requests needed to serve them """
+
+        return {"lookups": self.lookups, "requests": self.requests}
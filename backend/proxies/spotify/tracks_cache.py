@@ -4,41 +4,59 @@
     client) detail """
 
 from functools import wraps
+import sys
 
-class TracksCache:
+from backend.utils.lru_cache import LRUCache
+from backend.utils.track_registry import track_registry
+
+from .constants import TRACKS_CACHE_SIZE, TRACKS_CACHE_MAX_BYTES
+
+
+def sizeof_track_info(track_info):
+    """ Approximate amount of bytes used by a TrackInfo and its fields """
+
+    return sys.getsizeof(track_info) + sum(
+        sys.getsizeof(field) for field in track_info)
+
+
+class TracksCache(LRUCache):
     """ Class to be used as a singleton. Provides caching of a list of tracks
         and support for retrieval of cached values """
 
-    def __init__(self, limit=1000):
-        self.max_size = limit
-        self.track_id_list = []
-        self.cache = {}
+    def __init__(self, limit=TRACKS_CACHE_SIZE, max_bytes=TRACKS_CACHE_MAX_BYTES):
+        super().__init__(
+            max_size=limit, max_bytes=max_bytes,
+            sizeof=sizeof_track_info if max_bytes is not None else None)
 
     def cache_results(self, function):
-        """ Caches the results of the wrapped functions and returns them """
+        """ Caches the tracks from the results ({"result": [track_json]}) of the wrapped
+            function and returns them """
 
         @wraps(function)
         def wrapper(*args, **kwargs):
-            track_info_list = function(*args, **kwargs)
-            for track_info in track_info_list:
-                if track_info.id in self.cache:
+            response = function(*args, **kwargs)
+            if not isinstance(response, dict):
+                return response
+
+            for item in response.get("result", []):
+                if "length" not in item:    # Not a track
                     continue
-                elif len(self.track_id_list) > self.max_size:
-                    self.track_id_list.pop()
-                self.cache[track_info.id] = track_info
-                self.track_id_list.insert(0, track_info.id)
-            return track_info_list
+                track_info = track_registry.intern(
+                    item["name"], item["artist"], item["album"], item["id"],
+                    item["length"])
+                # Keyed by the shared id so that the parsed one can be freed
+                self.put(track_info.id, track_info)
+            return response
 
         return wrapper
 
-    def __contains__(self, track_id):
-        """ Checks if the track with ID track_id is in the cache """
-
-        return track_id in self.cache
-
     def __getitem__(self, key):
         """ Provides [] operator to the class """
 
-        return self.cache[key]
+        track_info = self.get(key)
+        if track_info is None:
+            raise KeyError(key)
+        return track_info
+
 
 tracks_cache = TracksCache()
@@ -1,33 +1,82 @@
 """ Contains the definitions of several utility functions used by the Spotify client """
 
+import time
 import requests
 from time import sleep
 
 from backend.utils.backend_adapter import BackendAdapter, TrackInfo, AlbumInfo, ArtistInfo
 from backend.utils.log import get_logger
 
+from .rate_limiter import rate_limiter, ENDPOINT_CLASSES, READ_ONLY_METHODS
+
 logger = get_logger("backend")
 
+RETRIABLE_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'PUT', 'DELETE'}
+
 
 def gen_playlist_name():
     """ Generates a name for the playlist based on a timestamp """
 
-    import time
     tm = time.gmtime(time.time())
     return 'musicracy-{}{}{}{}{}{}'.format(tm.tm_year, tm.tm_mon,
                                            tm.tm_mday, tm.tm_hour,
                                            tm.tm_min, tm.tm_sec)
 
 
+def _send_with_retries(f, self, *args, **kwargs):
+    """ Sends the request built by `f` pacing it with the rate limiter and retrying it
+        while Spotify answers with 429 or, for idempotent methods, with a 5xx """
+
+    endpoint_class = ENDPOINT_CLASSES.get(f.__name__, 'default')
+    attempt = 0
+    while True:
+        rate_limiter.wait(endpoint_class)
+
+        started = time.monotonic()
+        try:
+            response = f(self, *args, **kwargs)
+        finally:
+            self._http_stats.record(
+                f.__name__, (time.monotonic() - started) * 1000)
+
+        if attempt >= rate_limiter.max_attempts:
+            return response
+
+        if response.status_code == 429:
+            delay = rate_limiter.backoff(
+                attempt, response.headers.get('Retry-After'))
+            logger.info("%s was rate limited. Holding back '%s' requests for %.2fs",
+                        f.__name__, endpoint_class, delay)
+            rate_limiter.throttle(endpoint_class, delay)
+        elif (response.status_code in RETRIABLE_STATUSES
+              and response.request.method in IDEMPOTENT_METHODS):
+            delay = rate_limiter.backoff(attempt)
+            logger.info("%s failed with status %s. Will retry in %.2fs",
+                        f.__name__, response.status_code, delay)
+            sleep(delay)
+        else:
+            return response
+        attempt += 1
+
+
 def spotify_request(f):
     """ Wrapper to be used on methods from SpotifyClient which provides
-        uniform error handling and helps to avoid repeating the
-        same code all over the place """
+        uniform error handling, rate limiting and retries and helps to avoid
+        repeating the same code all over the place """
     from functools import wraps
     @wraps(f)
     def with_exception_handling(self, *args, **kwargs):
         try:
-            response = f(self, *args, **kwargs)
+            endpoint_class = ENDPOINT_CLASSES.get(f.__name__, 'default')
+            if (f.__name__ in READ_ONLY_METHODS
+                    and rate_limiter.is_throttled(endpoint_class)):
+                # Identical calls issued while throttled share a single request
+                key = (id(self), f.__name__, repr(args), repr(sorted(kwargs.items())))
+                response = rate_limiter.coalesce(
+                    key, lambda: _send_with_retries(f, self, *args, **kwargs))
+            else:
+                response = _send_with_retries(f, self, *args, **kwargs)
             response.raise_for_status()
 
             # TODO improve the logging here
@@ -37,10 +86,13 @@ def spotify_request(f):
             if exc.response is None:
                 msg = 'Empty response from Spotify'
             else:
-                error = exc.response.json()
-                message = error['error']['message']
-                status = error['error']['status']
-                msg = '{} (Status: {})'.format(message, status)
+                try:
+                    error = exc.response.json()
+                    message = error['error']['message']
+                    status = error['error']['status']
+                    msg = '{} (Status: {})'.format(message, status)
+                except (ValueError, KeyError, TypeError):
+                    msg = 'Status: {}'.format(exc.response.status_code)
             raise RuntimeError('{} request failed with error message: '
                                '{}'.format(f.__name__, msg)) from exc
         except Exception as exc:
@@ -6,7 +6,37 @@
 from collections import namedtuple
 from functools import wraps
 
-TrackInfo = namedtuple('TrackInfo', ['name', 'artist', 'album', 'id', 'length'])
+
+class TrackInfo:
+    """ Info of a track. Slotted to keep it compact since the backend holds lots of
+        them. Tracks are identified by their id, which is what equality and hashing
+        are based on. Use `track_registry.intern` to get the shared instance of a
+        track instead of creating a new one """
+
+    __slots__ = ('name', 'artist', 'album', 'id', 'length', '__weakref__')
+    _fields = ('name', 'artist', 'album', 'id', 'length')
+
+    def __init__(self, name, artist, album, id, length):
+        self.name = name
+        self.artist = artist
+        self.album = album
+        self.id = id
+        self.length = length
+
+    def __iter__(self):
+        return iter((self.name, self.artist, self.album, self.id, self.length))
+
+    def __eq__(self, other):
+        return isinstance(other, TrackInfo) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return ("TrackInfo(name={!r}, artist={!r}, album={!r}, id={!r}, "
+                "length={!r})".format(*self))
+
+
 AlbumInfo = namedtuple('AlbumInfo', ['name', 'artist', 'id'])
 ArtistInfo = namedtuple('ArtistInfo', ['name', 'id'])
 
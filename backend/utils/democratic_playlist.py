@@ -1,14 +1,287 @@
-from threading import RLock
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate
+from threading import RLock, Thread
+import json
+import os
 
 from backend.utils.backend_adapter import track_info_2_json
+from backend.utils.kv_outbox import KVOutbox
+from backend.utils.log import get_logger
+from backend.utils.playlist_events import PlaylistEvents
 from backend.utils.simple_kv_helpers import delete as delete_from_simple_kv
 
+logger = get_logger("backend")
+
+# The default playlist is refreshed in the background once less tracks than these remain
+DEFAULT_PLAYLIST_REFRESH_THRESHOLD = int(
+    os.environ.get("DEFAULT_PLAYLIST_REFRESH_THRESHOLD", 10))
+# Amount of encoded pages (whole playlist, top N...) of the playlist kept at once
+MAX_ENCODED_PLAYLISTS = 32
+# Tracks per chunk of the buckets of the VoteIndex, the most a change needs to copy
+BUCKET_CHUNK_SIZE = 64
+
 
 class EmptyPlaylistException(Exception):
     def __init__(self):
         pass
 
 
+class VoteIndex:
+    """ Keeps the tracks of the democratic playlist indexed by their amount of votes.
+        Tracks with the same amount of votes are kept in a bucket ordered by the time
+        they reached that amount, so the one that got there first wins the ties.
+        Voting and popping are O(log k + BUCKET_CHUNK_SIZE), k being the amount of
+        distinct vote counts (which is way smaller than the amount of tracks) """
+
+    def __init__(self):
+        self._votes = {}        # track_id -> votes
+        self._buckets = {}      # votes -> _Bucket
+        self._vote_counts = []  # Sorted vote counts of the non-empty buckets
+        self._frozen = {}       # votes -> _FrozenBucket as of the last snapshot
+        self._dirty = set()     # Vote counts of the buckets changed since then
+
+    def add(self, track_info, votes=1):
+        """ Adds `votes` to the track and returns the total amount of votes it has """
+
+        track_id = track_info.id
+        current_votes = self._votes.get(track_id, 0)
+        if current_votes:
+            self._discard(track_id, current_votes)
+
+        current_votes += votes
+        bucket = self._buckets.get(current_votes)
+        if bucket is None:
+            bucket = self._buckets[current_votes] = _Bucket()
+            insort(self._vote_counts, current_votes)
+        bucket.append(track_info)
+        self._dirty.add(current_votes)
+        self._votes[track_id] = current_votes
+        return current_votes
+
+    def pop(self):
+        """ Removes and returns (votes, TrackInfo) for the most voted track """
+
+        if not self._vote_counts:
+            raise EmptyPlaylistException()
+
+        votes = self._vote_counts[-1]
+        bucket = self._buckets[votes]
+        track_info = bucket.popleft()
+        self._dirty.add(votes)
+        if not bucket:
+            del self._buckets[votes]
+            self._vote_counts.pop()
+        del self._votes[track_info.id]
+        return votes, track_info
+
+    def snapshot(self, version, epoch):
+        """ Returns a PlaylistSnapshot of the tracks as they are now. It shares with
+            the previous one the buckets that didn't change and, within the ones that
+            did, the chunks that didn't """
+
+        for votes in self._dirty:
+            bucket = self._buckets.get(votes)
+            if bucket is None:
+                self._frozen.pop(votes, None)
+            else:
+                self._frozen[votes] = bucket.freeze()
+        self._dirty.clear()
+        return PlaylistSnapshot(
+            tuple(self._vote_counts), dict(self._frozen), version, epoch)
+
+    def _discard(self, track_id, votes):
+        """ Removes the track from the bucket of tracks having `votes` votes """
+
+        bucket = self._buckets[votes]
+        bucket.remove(track_id)
+        self._dirty.add(votes)
+        if not bucket:
+            del self._buckets[votes]
+            del self._vote_counts[bisect_left(self._vote_counts, votes)]
+
+    def __contains__(self, track_id):
+        return track_id in self._votes
+
+    def __len__(self):
+        return len(self._votes)
+
+
+class _Bucket:
+    """ Tracks having the same amount of votes, in the order they got them. They're
+        kept in tuples of up to BUCKET_CHUNK_SIZE tracks, so a change only copies the
+        chunk it touches and the snapshots share all the others """
+
+    __slots__ = ('_chunks', '_serials', '_serial_of', '_next_serial', '_frozen')
+
+    def __init__(self):
+        self._chunks = []       # Tuples of TrackInfo
+        self._serials = []      # Increasing serial of each chunk, to find them by bisect
+        self._serial_of = {}    # track_id -> serial of the chunk holding the track
+        self._next_serial = 0
+        self._frozen = None     # _FrozenBucket of the chunks until they change
+
+    def append(self, track_info):
+        if self._chunks and len(self._chunks[-1]) < BUCKET_CHUNK_SIZE:
+            self._chunks[-1] += (track_info,)
+        else:
+            self._chunks.append((track_info,))
+            self._serials.append(self._next_serial)
+            self._next_serial += 1
+        self._serial_of[track_info.id] = self._serials[-1]
+        self._frozen = None
+
+    def remove(self, track_id):
+        i = bisect_left(self._serials, self._serial_of.pop(track_id))
+        chunk = self._chunks[i]
+        for position, t_info in enumerate(chunk):
+            if t_info.id == track_id:
+                break
+        self._replace(i, chunk[:position] + chunk[position + 1:])
+
+    def popleft(self):
+        chunk = self._chunks[0]
+        del self._serial_of[chunk[0].id]
+        self._replace(0, chunk[1:])
+        return chunk[0]
+
+    def _replace(self, i, chunk):
+        """ Puts the chunk in place of the i-th one, merging it with a neighbour in
+            case both fit in one chunk so that removals don't leave many tiny ones """
+
+        self._frozen = None
+        if not chunk:
+            del self._chunks[i]
+            del self._serials[i]
+            return
+        self._chunks[i] = chunk
+        if i > 0 and len(self._chunks[i - 1]) + len(chunk) <= BUCKET_CHUNK_SIZE:
+            self._merge(i - 1)
+        elif (i + 1 < len(self._chunks)
+              and len(chunk) + len(self._chunks[i + 1]) <= BUCKET_CHUNK_SIZE):
+            self._merge(i)
+
+    def _merge(self, i):
+        """ Merges the chunk after the i-th one into it """
+
+        serial = self._serials[i]
+        for t_info in self._chunks[i + 1]:
+            self._serial_of[t_info.id] = serial
+        self._chunks[i] += self._chunks[i + 1]
+        del self._chunks[i + 1]
+        del self._serials[i + 1]
+
+    def freeze(self):
+        """ Returns the tracks as a _FrozenBucket, the same one until they change """
+
+        if self._frozen is None:
+            self._frozen = _FrozenBucket(tuple(self._chunks), len(self._serial_of))
+        return self._frozen
+
+    def __len__(self):
+        return len(self._serial_of)
+
+
+class _FrozenBucket:
+    """ Immutable bucket of a snapshot, made of the chunks of the bucket at the time """
+
+    __slots__ = ('_chunks', 'size')
+
+    def __init__(self, chunks, size):
+        self._chunks = chunks
+        self.size = size
+
+    def slice(self, start, end=None):
+        """ Returns the list of the tracks from `start` to `end` (exclusive) """
+
+        end = self.size if end is None else min(end, self.size)
+        tracks = []
+        for chunk in self._chunks:
+            if end <= 0:
+                break
+            if start < len(chunk):
+                tracks.extend(chunk[start:end])
+                start = 0
+            else:
+                start -= len(chunk)
+            end -= len(chunk)
+        return tracks
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __len__(self):
+        return self.size
+
+
+class PlaylistSnapshot:
+    """ Immutable view of the democratic playlist at a given version. A new one is
+        published after every change, so readers get a consistent playlist without
+        taking the lock. Its buckets are shared with the previous snapshot unless
+        they changed, and even then only the chunk that changed is copied """
+
+    __slots__ = ('version', 'etag', 'encoded', '_counts', '_buckets', '_starts',
+                 '_total')
+
+    def __init__(self, counts, buckets, version, epoch):
+        self.version = version
+        self.etag = '"{}-{}"'.format(epoch, version)
+        # (limit, offset, cursor) -> JSON bytes of the pages of this version
+        self.encoded = {}
+        self._counts = counts       # Sorted vote counts of the non-empty buckets
+        self._buckets = buckets     # votes -> _FrozenBucket in the order they'd be popped
+        # Rank of the first track of each bucket, by rank
+        ends = list(accumulate(buckets[votes].size for votes in reversed(counts)))
+        self._starts = [0] + ends[:-1]
+        self._total = ends[-1] if ends else 0
+
+    def page(self, limit=None, offset=0, after=None):
+        """ Returns ([(votes, TrackInfo)], next cursor) for the `limit` tracks (all of
+            them if `limit` is None) starting at rank `offset` or, if `after` is given
+            as (votes, track_id), right after that track """
+
+        if limit is not None and limit <= 0:
+            return [], None
+
+        # Position of the first track of the page as (bucket by rank, index in it)
+        if after is not None:
+            after_votes, after_id = after
+            i = bisect_left(self._counts, after_votes)
+            bucket_rank, index = len(self._counts) - i, 0
+            if i < len(self._counts) and self._counts[i] == after_votes:
+                bucket_rank -= 1
+                # In case the track moved to another bucket the page starts at the
+                # beginning of its old one: some tracks may repeat but none is missed
+                for position, t_info in enumerate(self._buckets[after_votes]):
+                    if t_info.id == after_id:
+                        index = position + 1
+                        break
+        elif offset >= self._total:
+            return [], None
+        else:
+            bucket_rank = bisect_right(self._starts, offset) - 1
+            index = offset - self._starts[bucket_rank]
+
+        first_rank = (self._starts[bucket_rank] + index
+                      if bucket_rank < len(self._starts) else self._total)
+        tracks = []
+        while bucket_rank < len(self._starts) and (limit is None or len(tracks) < limit):
+            votes = self._counts[-1 - bucket_rank]
+            bucket = self._buckets[votes]
+            end = None if limit is None else index + limit - len(tracks)
+            tracks.extend((votes, t_info) for t_info in bucket.slice(index, end))
+            bucket_rank, index = bucket_rank + 1, 0
+
+        next_cursor = None
+        if tracks and limit is not None and first_rank + limit < self._total:
+            votes, t_info = tracks[-1]
+            next_cursor = "{}:{}".format(votes, t_info.id)
+        return tracks, next_cursor
+
+    def __len__(self):
+        return self._total
+
+
 class DemocraticPlaylist:
     def __init__(self, **config):
 
@@ -20,71 +293,101 @@ class DemocraticPlaylist:
         self.playlist_name = config.get('DEMOCRATIC_PLAYLIST_NAME', '')
         self.playlist_id = config.get('DEMOCRATIC_PLAYLIST_ID', '')
         self._lock = RLock()
-        self._track_map = {}
-        self._track_list = []
+        self._vote_index = VoteIndex()
         self._current_track = None
         self._default_track_set = set()
         self._default_playlist_id = config['DEFAULT_PLAYLIST_ID']
+        self._default_refresh_thread = None
+        self.events = PlaylistEvents()
+        # Replaced on every change. Readers only ever look at the current one
+        self._snapshot = self._vote_index.snapshot(self.events.version, self.events.epoch)
+        # track_id -> JSON members of the track, encoded once per track
+        self._encoded_track_infos = {}
+        # Sends the changes to the Simple KV without holding the lock
+        self.kv_outbox = KVOutbox()
+        self.kv_outbox.start()
 
     def _update_default_playlist(self):
         """ Updates the list of default tracks to be used in case the main playlist
-            is empty. Implementation depends on the back-end used """
+            is empty. Implementation depends on the back-end used. It's called without
+            holding the lock when refreshing in the background, so it should only take
+            it to replace the set of default tracks """
 
         raise NotImplementedError(
             '_update_default_playlist cannot be called in DefaultPlaylist')
 
-    def vote(self, track_info):
-        """ Add one vote to the track and update the internal data structures """
+    def _refresh_default_playlist(self):
+        """ Updates the default playlist from a separate thread so that picking the
+            next track doesn't need to wait for it """
+
+        if (self._default_refresh_thread is not None
+                and self._default_refresh_thread.is_alive()):
+            return
+
+        def refresh():
+            try:
+                self._update_default_playlist()
+            except Exception as exc:
+                logger.error("Failed to refresh the default playlist: %s", exc)
+
+        self._default_refresh_thread = Thread(target=refresh, daemon=True)
+        self._default_refresh_thread.start()
+
+    def vote(self, track_info, votes=1):
+        """ Add `votes` votes to the track and update the internal data structures """
+
+        with self._lock:
+            # A voted track from the default playlist now belongs to the democratic one
+            self._default_track_set.discard(track_info)
+            total = self._vote_index.add(track_info, votes)
+            self._changed(_vote_event(track_info, total))
+
+    def vote_batch(self, track_votes):
+        """ Applies [(TrackInfo, votes)] taking the lock only once """
 
-        # TODO rewrite this more nicely
         with self._lock:
-            current_votes = 0
-            track_id = track_info.id
-            if track_id in self._track_map.keys():
-                pos = self._track_map[track_id]
-                current_votes, _ = self._track_list[pos]
-                del self._track_list[pos]
-            elif track_id in self._default_track_set:
-                self._default_track_set.remove(track_id)
-                self._track_list.insert(0, track_id)
-                self._track_map = {k: v+1 for k, v in self._track_map.items()}
-                self._track_map[track_id] = 0
-                return
-
-            current_votes += 1
-            left = [x for x in self._track_list if x[0] < current_votes]
-            right = [x for x in self._track_list if x[0] >= current_votes]
-
-            self._track_list = left + [(current_votes, track_info)] + right
-            self._track_map[track_id] = len(left)
-
-            # Correct the positions of the tracks that swapped their position with the
-            # track being currently voted
-            for i in range(len(self._track_list)):
-                _, track_info = self._track_list[i]
-                self._track_map[track_info.id] = i
+            events = []
+            for track_info, votes in track_votes:
+                self._default_track_set.discard(track_info)
+                total = self._vote_index.add(track_info, votes)
+                events.append(_vote_event(track_info, total))
+            if events:
+                self._changed(*events)
 
     def next(self):
         """ Get the next track. Resort to the default playlist in case the democratic
             playlist is empty """
 
         with self._lock:
-            if not self._track_list:
+            if not self._vote_index:
                 return self._next_from_default_playlist()
 
-            _, self._current_track = self._track_list.pop()
-            del self._track_map[self._current_track.id]
+            _, self._current_track = self._vote_index.pop()
+            self._encoded_track_infos.pop(self._current_track.id, None)
+            self._changed({"type": "next", "track_id": self._current_track.id})
             # Remove the track from the simple_kv so that the clients
-            # that vote for it can vote it again
-            delete_from_simple_kv(self._current_track.id)
+            # that vote for it can vote it again. The outbox takes care of retrying
+            self.kv_outbox.put(delete_from_simple_kv, self._current_track.id,
+                               max_retries=0)
             return self._current_track
 
+    def _changed(self, *events):
+        """ Publishes the events of a change and a new snapshot of the playlist. Must
+            be called with the lock held """
+
+        version = self.events.publish(*events)
+        self._snapshot = self._vote_index.snapshot(version, self.events.epoch)
+
     def _next_from_default_playlist(self):
         """ Gets a track from the default playlist. Update it in case it's empty """
 
+        # Only happens when the background refresh didn't make it on time
         if not self._default_track_set:
             self._update_default_playlist()
         self._current_track = self._default_track_set.pop()
+
+        if len(self._default_track_set) < DEFAULT_PLAYLIST_REFRESH_THRESHOLD:
+            self._refresh_default_playlist()
         return self._current_track
 
     def current(self):
@@ -93,17 +396,71 @@ class DemocraticPlaylist:
         return self._current_track
 
     def __len__(self):
-        return len(self._track_list)
+        return len(self._snapshot)
 
-    def get_tracks(self):
+    def get_tracks(self, limit=None, offset=0, cursor=None):
         """ Returns [(votes, TrackInfo)] populated with the tracks from the democratic
-            playlist. The list is reversed so that elements are ordered decreasingly
-            according to the number of votes """
-        with self._lock:
-            ret = []
-            for (votes, t_info) in self._track_list[::-1]:
-                info = {"votes": votes}
-                info = {**info, **track_info_2_json(t_info)}
-                ret.append(info)
-            return {"result": ret}
-            # return self._track_list[::-1]
+            playlist. Elements are ordered decreasingly according to the number of votes
+            and only `limit` of them are returned in case it's given, starting at rank
+            `offset` or right after the track of the `cursor` returned along with the
+            previous page. The version of the playlist they belong to, the total amount
+            of tracks and the cursor of the next page (if any) come along with them """
+        snapshot = self._snapshot
+        after = parse_cursor(cursor) if cursor is not None else None
+        tracks, next_cursor = snapshot.page(limit, offset, after)
+        ret = []
+        for (votes, t_info) in tracks:
+            info = {"votes": votes}
+            info = {**info, **track_info_2_json(t_info)}
+            ret.append(info)
+        return {"result": ret, "version": snapshot.version,
+                "total": len(snapshot), "next_cursor": next_cursor}
+
+    def get_encoded_tracks(self, limit=None, offset=0, cursor=None):
+        """ Returns (ETag, JSON bytes) for the page of the democratic playlist as
+            returned by `get_tracks`. Pages are encoded once per version and, like
+            the rest of the reads, without taking the lock """
+
+        snapshot = self._snapshot
+        key = (limit, offset, cursor)
+        content = snapshot.encoded.get(key)
+        if content is None:
+            content = self._encode_tracks(snapshot, limit, offset, cursor)
+            if len(snapshot.encoded) >= MAX_ENCODED_PLAYLISTS:
+                snapshot.encoded.clear()
+            # Concurrent readers may encode the same page, the result is the same
+            snapshot.encoded[key] = content
+        return snapshot.etag, content
+
+    def _encode_tracks(self, snapshot, limit, offset, cursor):
+        after = parse_cursor(cursor) if cursor is not None else None
+        tracks, next_cursor = snapshot.page(limit, offset, after)
+        items = []
+        for votes, t_info in tracks:
+            members = self._encoded_track_infos.get(t_info.id)
+            if members is None:
+                # The members of the object without the braces. A reader still on an
+                # older snapshot may put back the ones of a track that was just played,
+                # which only costs keeping them until the track is played again
+                members = json.dumps(track_info_2_json(t_info))[1:-1].encode()
+                self._encoded_track_infos[t_info.id] = members
+            items.append(b'{"votes": %d, %s}' % (votes, members))
+
+        return b'{"result": [%s], "version": %d, "total": %d, "next_cursor": %s}' % (
+            b", ".join(items), snapshot.version, len(snapshot),
+            json.dumps(next_cursor).encode())
+
+    def get_events(self, since, timeout=None):
+        """ Returns the changes of the playlist after version `since`. See
+            PlaylistEvents.wait """
+        return self.events.wait(since, timeout)
+
+
+def parse_cursor(cursor):
+    """ Returns the (votes, track_id) of a cursor. Raises ValueError if it's invalid """
+    votes, track_id = cursor.split(":", 1)
+    return int(votes), track_id
+
+
+def _vote_event(track_info, votes):
+    return {"type": "vote", "track": {"votes": votes, **track_info_2_json(track_info)}}
@@ -0,0 +1,145 @@
+""" Defines the outbox used to send the side effects of the playlist on the Simple KV
+    from a separate thread, so that a slow Simple KV doesn't hold the playlist back """
+
+from collections import deque
+from threading import Condition, Thread
+import os
+import random
+import time
+
+from backend.utils.log import get_logger
+
+logger = get_logger("backend")
+
+KV_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("KV_OUTBOX_MAX_ATTEMPTS", 10))
+KV_OUTBOX_MAX_DEPTH = int(os.environ.get("KV_OUTBOX_MAX_DEPTH", 10000))
+KV_OUTBOX_BACKOFF_BASE_SECS = float(os.environ.get("KV_OUTBOX_BACKOFF_BASE_SECS", 0.5))
+KV_OUTBOX_BACKOFF_MAX_SECS = float(os.environ.get("KV_OUTBOX_BACKOFF_MAX_SECS", 30))
+
+
+class _Entry:
+    __slots__ = ('function', 'args', 'kwargs', 'enqueued_at', 'attempts')
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def __str__(self):
+        return "{}{}".format(getattr(self.function, "__name__", "call"), self.args)
+
+
+class KVOutbox(Thread):
+    """ Calls the functions put in it one at a time and in order. Calls that raise are
+        retried with jittered exponential backoff up to `max_attempts` times before
+        being given up on. Once `max_depth` calls are pending the oldest ones are
+        dropped """
+
+    def __init__(self, max_attempts=KV_OUTBOX_MAX_ATTEMPTS,
+                 max_depth=KV_OUTBOX_MAX_DEPTH,
+                 backoff_base=KV_OUTBOX_BACKOFF_BASE_SECS,
+                 backoff_max=KV_OUTBOX_BACKOFF_MAX_SECS):
+        super().__init__(daemon=True)
+
+        self.max_attempts = max_attempts
+        self.max_depth = max_depth
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._pending = deque()
+        self._in_flight = None
+        self._cond = Condition()
+        self._stopping = False
+
+        self._delivered = 0
+        self._retries = 0
+        self._failed = 0
+        self._dropped = 0
+        self._last_delivery_lag_ms = 0.0
+
+    def put(self, function, *args, **kwargs):
+        """ Enqueues a call to `function` without waiting for it to happen """
+
+        with self._cond:
+            if len(self._pending) >= self.max_depth:
+                dropped = self._pending.popleft()
+                self._dropped += 1
+                logger.error("KV outbox full, dropped %s", dropped)
+            self._pending.append(_Entry(function, args, kwargs))
+            self._cond.notify()
+
+    def stop(self, timeout=None):
+        """ Sends whatever is pending, without retrying failures anymore, and makes the
+            thread exit """
+
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self.join(timeout)
+
+    def backoff(self, attempt):
+        """ Returns how long to wait before the given retry ("full jitter") """
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    break
+                entry = self._in_flight = self._pending.popleft()
+
+            while not self._send(entry):
+                # Stopping cuts the wait short, the next attempt is the last one
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stopping,
+                                        self.backoff(entry.attempts - 1))
+
+            with self._cond:
+                self._in_flight = None
+
+    def _send(self, entry):
+        """ Calls the function of the entry. Returns whether it's done with it, be it
+            because it was sent or because it was given up on """
+
+        entry.attempts += 1
+        try:
+            entry.function(*entry.args, **entry.kwargs)
+        except Exception as exc:
+            if entry.attempts < self.max_attempts and not self._stopping:
+                self._retries += 1
+                logger.debug("KV outbox call %s failed (attempt %s): %s",
+                             entry, entry.attempts, exc)
+                return False
+            self._failed += 1
+            logger.error("KV outbox gave up on %s after %s attempts: %s",
+                         entry, entry.attempts, exc)
+            return True
+
+        self._delivered += 1
+        self._last_delivery_lag_ms = (time.monotonic() - entry.enqueued_at) * 1000
+        return True
+
+    def stats(self):
+        """ Returns the configuration and counters of the outbox. `lag_ms` is how long
+            the oldest pending call has been waiting """
+
+        with self._cond:
+            depth = len(self._pending) + (self._in_flight is not None)
+            oldest = self._in_flight or (self._pending[0] if self._pending else None)
+
+        return {
+            "max_attempts": self.max_attempts,
+            "max_depth": self.max_depth,
+            "depth": depth,
+            "lag_ms": round((time.monotonic() - oldest.enqueued_at) * 1000, 3)
+                      if oldest is not None else 0.0,
+            "delivered": self._delivered,
+            "retries": self._retries,
+            "failed": self._failed,
+            "dropped": self._dropped,
+            "last_delivery_lag_ms": round(self._last_delivery_lag_ms, 3),
+        }
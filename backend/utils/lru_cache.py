@@ -0,0 +1,93 @@
+""" Defines a thread-safe LRU cache with optional TTL for its entries """
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class LRUCache:
+    """ Bounded mapping that evicts the least recently used entry once it's full.
+        Entries older than `ttl` seconds (if given) are treated as missing. In case
+        `max_bytes` is given, `sizeof(value)` is used to keep the accumulated size of
+        the values under it as well """
+
+    def __init__(self, max_size=1000, ttl=None, max_bytes=None, sizeof=None):
+        if max_bytes is not None and sizeof is None:
+            raise RuntimeError("max_bytes requires a sizeof function")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """ Returns the value associated to `key` and marks it as the most recently
+            used one. Returns `default` in case it's missing or expired """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Associates `value` to `key`, evicting the least recently used entries
+            in case the cache is full """
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        size = self._sizeof(value) if self._sizeof is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_size or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _remove(self, key):
+        """ Removes the entry of `key`. Must be called with the lock held """
+
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (
+                entry[0] is None or entry[0] > time.monotonic())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """ Returns the size and counters of the cache """
+
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
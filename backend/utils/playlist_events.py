@@ -0,0 +1,51 @@
+""" Log of the changes of the democratic playlist that clients can wait on, so that they
+    learn about them without polling the whole playlist """
+
+from collections import deque
+from threading import Condition
+from uuid import uuid4
+import os
+
+# Amount of versions kept in the log. Clients further behind have to start over
+PLAYLIST_EVENTS_LOG_SIZE = int(os.environ.get("PLAYLIST_EVENTS_LOG_SIZE", 1000))
+
+
+class PlaylistEvents:
+    """ Keeps the latest changes of the playlist tagged with a version that increases
+        with every change """
+
+    def __init__(self, max_size=PLAYLIST_EVENTS_LOG_SIZE):
+        self.version = 0
+        # Tells apart the versions of different runs of the backend
+        self.epoch = uuid4().hex[:8]
+        self._log = deque(maxlen=max_size)  # (version, [event])
+        self._cond = Condition()
+
+    def publish(self, *events):
+        """ Records the events as a single new version and wakes the waiting clients.
+            Returns the new version """
+
+        with self._cond:
+            self.version += 1
+            self._log.append((self.version, list(events)))
+            self._cond.notify_all()
+            return self.version
+
+    def wait(self, since, timeout=None):
+        """ Returns {"version": ..., "events": [...]} with the events published after
+            version `since`, waiting up to `timeout` seconds for one in case there's
+            none yet. In case the events after `since` aren't known anymore returns
+            {"version": ..., "reset": True} instead """
+
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != since, timeout)
+
+            oldest = self._log[0][0] if self._log else self.version + 1
+            if since > self.version or (since < self.version and since + 1 < oldest):
+                return {"version": self.version, "reset": True}
+
+            events = []
+            for version, version_events in self._log:
+                if version > since:
+                    events.extend(version_events)
+            return {"version": self.version, "events": events}
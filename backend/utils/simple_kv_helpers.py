@@ -1,60 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
-import time
-from requests import get, post, exceptions
+from requests import exceptions
 
 from backend.utils.log import get_logger
+from common.http_client import HttpClient
+from common.simple_kv_shards import SHARD_URLS
 
 logger = get_logger("backend_debug")
 
-SIMPLE_KV_HOST = os.environ.get("SIMPLE_KV_HOST", "simple_kv")
-SIMPLE_KV_PORT = os.environ.get("SIMPLE_KV_PORT", 5002)
 MAX_RETRIES = os.environ.get("SIMPLE_KV_MAX_RETRIES", 5)
-SIMPLE_KV_URL = "http://{}:{}".format(SIMPLE_KV_HOST, SIMPLE_KV_PORT)
+POOL_SIZE = int(os.environ.get("SIMPLE_KV_POOL_SIZE", 10))
+
+# Shared by every thread so that connections to the Simple KV are kept open and
+# reused instead of paying for a new one on each request
+_client = HttpClient(pool_connections=len(SHARD_URLS), pool_size=POOL_SIZE,
+                     logger=logger)
+
+# Requests that go to every shard are sent concurrently
+_fan_out_executor = ThreadPoolExecutor(max_workers=len(SHARD_URLS))
 
 
 def ping(max_retries=MAX_RETRIES):
-    """ Pings the Simple KV and retries up to MAX_RETRIES in case there's no answer """
-    while True:
+    """ Pings every shard of the Simple KV and retries up to MAX_RETRIES in case there's
+        no answer """
+    for url in SHARD_URLS:
+        logger.debug("Pinging the simpleKV to %s", url)
         try:
-            logger.debug("Pinging the simpleKV to %s:%s",
-                         SIMPLE_KV_HOST, SIMPLE_KV_PORT)
-            r = get(SIMPLE_KV_URL + "/ping")
-            r.raise_for_status()
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "PING to simple-kv failed after {} attempts: {}".format(
-                        5, err))
-            time.sleep(0.5)
-            max_retries -= 1
-            continue
+            _client.get(url + "/ping", max_retries=max_retries)
         except exceptions.HTTPError as err:
             raise RuntimeError(
                 "PING to simple-kv failed with error: {}".format(err))
-        return
 
 
 def delete(value, max_retries=MAX_RETRIES):
     """ Performs remote call to the Simple KV to delete the given `value`
-        from all the keys is associated to """
-    while True:
-        try:
-            r = post(
-                SIMPLE_KV_URL,
-                json={"value": value, "action": "delete"})
-            r.raise_for_status()
-            return r.json() if r.text else None
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "POST request to simple-kv endpoint '{}' failed: {}".format(
-                        SIMPLE_KV_URL, err))
-            max_retries -= 1
-            time.sleep(0.5)
-            continue
-        except exceptions.HTTPError as e:
-            msg = str(e)
-            if e.response is not None:
-                msg = msg + ". Response body: " + e.response.text
-            logger.error(
-                "Error while deleting value from simple-kv: %s", msg)
+        from all the keys is associated to. Since any key might hold it, the request
+        is sent to all the shards at once. Raises RuntimeError if it fails """
+    if len(SHARD_URLS) == 1:
+        return _delete_from_shard(SHARD_URLS[0], value, max_retries)
+    futures = [_fan_out_executor.submit(_delete_from_shard, url, value, max_retries)
+               for url in SHARD_URLS]
+    for future in futures:
+        future.result()
+
+
+def _delete_from_shard(url, value, max_retries):
+    try:
+        r = _client.post(url, max_retries=max_retries,
+                         json={"value": value, "action": "delete"})
+        return r.json() if r.text else None
+    except exceptions.HTTPError as e:
+        msg = str(e)
+        if e.response is not None:
+            msg = msg + ". Response body: " + e.response.text
+        raise RuntimeError(
+            "Error while deleting value from simple-kv: {}".format(msg))
+
+
+def client_stats():
+    """ Returns the latency histograms of the requests sent to the Simple KV """
+    return _client.stats()
@@ -0,0 +1,40 @@
+""" Registry that keeps a single instance of each track no matter how many times and
+    from where (searches, the default playlist, lookups...) its info was received """
+
+from threading import Lock
+from weakref import WeakValueDictionary
+import sys
+
+from backend.utils.backend_adapter import TrackInfo
+
+
+class TrackRegistry:
+    """ Maps track ids to their shared TrackInfo. Artist and album names are interned
+        so that they're shared among the tracks too. Tracks are only referenced
+        weakly: they're dropped once nothing else (caches, playlists...) holds them """
+
+    def __init__(self):
+        self._tracks = WeakValueDictionary()
+        self._lock = Lock()
+
+    def intern(self, name, artist, album, track_id, length):
+        """ Returns the shared TrackInfo of the track, creating it if needed """
+
+        track_info = self._tracks.get(track_id)
+        if track_info is not None:
+            return track_info
+
+        with self._lock:
+            track_info = self._tracks.get(track_id)
+            if track_info is None:
+                # Only the fields repeated among tracks are worth interning
+                track_info = TrackInfo(name, sys.intern(artist), sys.intern(album),
+                                       track_id, length)
+                self._tracks[track_info.id] = track_info
+            return track_info
+
+    def __len__(self):
+        return len(self._tracks)
+
+
+track_registry = TrackRegistry()
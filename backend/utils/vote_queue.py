@@ -0,0 +1,129 @@
+""" Defines the queue used to acknowledge votes right away and apply them to the
+    playlist in batches from a separate thread """
+
+from collections import Counter
+from queue import Queue, Empty, Full
+from threading import Thread
+import os
+import time
+
+from backend.utils.log import get_logger
+
+logger = get_logger("backend")
+
+VOTE_BATCH_SIZE = int(os.environ.get("VOTE_BATCH_SIZE", 100))
+VOTE_FLUSH_INTERVAL_MS = int(os.environ.get("VOTE_FLUSH_INTERVAL_MS", 50))
+VOTE_QUEUE_MAX_DEPTH = int(os.environ.get("VOTE_QUEUE_MAX_DEPTH", 10000))
+
+_STOP = object()
+
+
+class VoteQueueFullException(Exception):
+    """ Raised when a vote is submitted while the queue is at its maximum depth """
+
+
+class VoteQueue(Thread):
+    """ Collects incoming votes and hands them over to `apply_votes` in batches of up
+        to `batch_size` votes, or whatever arrived within `flush_interval_ms` since the
+        first vote of the batch. Repeated votes for the same track are coalesced so
+        `apply_votes` receives a {track_id: votes} mapping """
+
+    def __init__(self, apply_votes,
+                 batch_size=VOTE_BATCH_SIZE,
+                 flush_interval_ms=VOTE_FLUSH_INTERVAL_MS,
+                 max_depth=VOTE_QUEUE_MAX_DEPTH):
+        super().__init__(daemon=True)
+
+        self._apply_votes = apply_votes
+        self._queue = Queue(maxsize=max_depth)
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self.max_depth = max_depth
+
+        self._batches_applied = 0
+        self._votes_applied = 0
+        self._votes_failed = 0
+        self._last_batch_size = 0
+        self._last_flush_latency_ms = 0.0
+
+    def put(self, track_id):
+        """ Enqueues a vote for the given track without waiting for it to be applied """
+
+        try:
+            self._queue.put_nowait(track_id)
+        except Full:
+            raise VoteQueueFullException()
+
+    def stop(self):
+        """ Applies whatever is pending and makes the thread exit """
+
+        self._queue.put(_STOP)
+        self.join()
+
+    def run(self):
+        running = True
+        while running:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+
+            # Time elapsed since the oldest vote of the batch was taken from the queue
+            started = time.monotonic()
+            deadline = started + self.flush_interval_ms / 1000
+            batch = Counter()
+            size = self._count(batch, first)
+            while size < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    track_id = (self._queue.get(timeout=timeout) if timeout > 0
+                                else self._queue.get_nowait())
+                except Empty:
+                    break
+                if track_id is _STOP:
+                    running = False
+                    break
+                size += self._count(batch, track_id)
+
+            if size:
+                self._flush(batch, size, started)
+
+    def _count(self, batch, track_id):
+        """ Adds the vote to the batch. Returns how many votes were added, none for
+            a track id that can't be counted, so that it can't stop the thread """
+
+        try:
+            batch[track_id] += 1
+            return 1
+        except Exception as exc:
+            self._votes_failed += 1
+            logger.error("Dropped a vote for an invalid track id %r: %s", track_id, exc)
+            return 0
+
+    def _flush(self, batch, size, started):
+        """ Hands a batch of coalesced votes over to `apply_votes` """
+
+        try:
+            self._apply_votes(dict(batch))
+            self._votes_applied += size
+        except Exception as exc:
+            self._votes_failed += size
+            logger.error("Failed to apply a batch of %s votes: %s", size, exc)
+
+        self._batches_applied += 1
+        self._last_batch_size = size
+        self._last_flush_latency_ms = (time.monotonic() - started) * 1000
+
+    def stats(self):
+        """ Returns the configuration and counters of the queue """
+
+        return {
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval_ms,
+            "max_depth": self.max_depth,
+            "queue_depth": self._queue.qsize(),
+            "batches_applied": self._batches_applied,
+            "votes_applied": self._votes_applied,
+            "votes_failed": self._votes_failed,
+            "last_batch_size": self._last_batch_size,
+            "last_flush_latency_ms": round(self._last_flush_latency_ms, 3),
+        }
@@ -0,0 +1,186 @@
+""" HTTP client shared by the services to talk to each other. Connections are pooled
+    and reused, failed connections are retried with jittered exponential backoff and
+    the latency of every endpoint is recorded in a histogram """
+
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from urllib.parse import urlsplit
+import asyncio
+import logging
+import os
+import random
+import time
+
+from requests import adapters, exceptions, Session
+
+CONNECT_TIMEOUT_SECS = float(os.environ.get("HTTP_CONNECT_TIMEOUT_SECS", 3))
+READ_TIMEOUT_SECS = float(os.environ.get("HTTP_READ_TIMEOUT_SECS", 30))
+BACKOFF_BASE_SECS = float(os.environ.get("HTTP_BACKOFF_BASE_SECS", 0.1))
+BACKOFF_MAX_SECS = float(os.environ.get("HTTP_BACKOFF_MAX_SECS", 2))
+
+# Upper bounds (in ms) of the buckets of the latency histograms
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """ Thread-safe histogram of latencies in milliseconds """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._total_ms = 0.0
+        self._lock = Lock()
+
+    def record(self, elapsed_ms):
+        with self._lock:
+            self._counts[bisect_left(self.buckets, elapsed_ms)] += 1
+            self._total_ms += elapsed_ms
+
+    def percentile(self, p):
+        """ Returns the upper bound of the bucket the p-th percentile falls in """
+        with self._lock:
+            counts = list(self._counts)
+        target = sum(counts) * p / 100
+        accumulated = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            accumulated += count
+            if count and accumulated >= target:
+                return bound
+        return None
+
+    def stats(self):
+        with self._lock:
+            counts = list(self._counts)
+            total_ms = self._total_ms
+        count = sum(counts)
+        labels = ["<={}".format(b) for b in self.buckets] + [
+            ">{}".format(self.buckets[-1])]
+        return {
+            "count": count,
+            "mean_ms": round(total_ms / count, 3) if count else None,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "buckets": {l: c for l, c in zip(labels, counts) if c},
+        }
+
+
+class HttpClient:
+    """ Sends requests to `base_url` + path through a pooled session. Requests that
+        couldn't connect are retried up to `max_retries` times, any other failure is
+        raised right away: HTTP errors as requests.HTTPError and the rest of them as
+        RuntimeError """
+
+    def __init__(self, base_url="", max_retries=5, pool_connections=1, pool_size=10,
+                 connect_timeout=CONNECT_TIMEOUT_SECS, read_timeout=READ_TIMEOUT_SECS,
+                 backoff_base=BACKOFF_BASE_SECS, backoff_max=BACKOFF_MAX_SECS,
+                 logger=None):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.timeout = (connect_timeout, read_timeout)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._session = Session()
+        adapter = adapters.HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._histograms = {}
+        self._lock = Lock()
+        self.retries = 0
+
+    def backoff(self, attempt):
+        """ Returns how long to wait before the given retry ("full jitter") """
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _histogram(self, endpoint):
+        histogram = self._histograms.get(endpoint)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(endpoint, LatencyHistogram())
+        return histogram
+
+    def request(self, method, path="", max_retries=None, **kwargs):
+        """ Sends the request and returns the response once its status was checked """
+        url = self.base_url + path
+        endpoint = "{} {}".format(method, urlsplit(url).path or "/")
+        max_retries = self.max_retries if max_retries is None else int(max_retries)
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                r = self._session.request(method, url, **kwargs)
+            except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
+                if attempt >= max_retries:
+                    raise RuntimeError(
+                        "{} request to '{}' failed after {} attempts: {}".format(
+                            method, url, attempt + 1, err))
+                delay = self.backoff(attempt)
+                self.logger.debug("%s request to '%s' failed: %s. Retrying in %.2fs",
+                                  method, url, err, delay)
+                self.retries += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except exceptions.Timeout as err:
+                raise RuntimeError(
+                    "{} request to '{}' timed out: {}".format(method, url, err))
+            finally:
+                self._histogram(endpoint).record(
+                    (time.perf_counter() - started) * 1000)
+            r.raise_for_status()
+            return r
+
+    def get(self, path="", **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path="", **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def stats(self):
+        """ Returns the latency histogram of every endpoint and the retry counter """
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {
+            "retries": self.retries,
+            "endpoints": {e: h.stats() for e, h in sorted(histograms.items())},
+        }
+
+    def close(self):
+        self._session.close()
+
+
+class AsyncHttpClient:
+    """ asyncio flavour of the HttpClient. Requests run on a bounded pool of threads
+        sharing the pooled session of the wrapped client, so awaiting them doesn't
+        block the loop """
+
+    def __init__(self, base_url="", max_workers=10, **kwargs):
+        kwargs.setdefault("pool_size", max_workers)
+        self.client = HttpClient(base_url, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def request(self, method, path="", **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(self.client.request, method, path, **kwargs))
+
+    async def get(self, path="", **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path="", **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    def stats(self):
+        return self.client.stats()
+
+    def close(self):
+        self._executor.shutdown()
+        self.client.close()
@@ -0,0 +1,42 @@
+""" Location of the Simple KV shards, shared by the services that talk to it, and the
+    consistent hashing of the keys to the shards that hold them """
+from bisect import bisect
+from hashlib import md5
+import os
+
+SIMPLE_KV_HOST = os.environ.get("SIMPLE_KV_HOST", "simple_kv")
+SIMPLE_KV_PORT = os.environ.get("SIMPLE_KV_PORT", 5002)
+SIMPLE_KV_URL = "http://{}:{}".format(SIMPLE_KV_HOST, SIMPLE_KV_PORT)
+# Comma separated host:port of the Simple KV shards. Keys are distributed among them
+# by consistent hashing. Defaults to the single SIMPLE_KV_HOST:SIMPLE_KV_PORT one
+SIMPLE_KV_SHARDS = os.environ.get("SIMPLE_KV_SHARDS")
+SHARD_URLS = (["http://" + shard.strip() for shard in SIMPLE_KV_SHARDS.split(",")]
+              if SIMPLE_KV_SHARDS else [SIMPLE_KV_URL])
+
+
+def _hash(value):
+    return int(md5(value.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """ Maps keys to nodes so that adding or removing a node only moves the keys of
+        that node. Every node is placed `replicas` times on the ring to even out the
+        share of keys each one gets """
+
+    def __init__(self, nodes, replicas=100):
+        if not nodes:
+            raise RuntimeError("A hash ring needs at least one node")
+
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash("{}#{}".format(node, i)), node)
+            for node in self.nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        """ Returns the node that holds the given key """
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        index = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
@@ -1,15 +1,26 @@
-from flask import render_template, request, redirect, url_for
+from queue import Empty
+import json
+import os
+
+from flask import render_template, request, redirect, url_for, jsonify, Response
 
 from frontend.app import session
 from frontend.utils.log import get_logger
 from frontend.utils.request_helpers import get, post
-from frontend.utils.simple_kv_helpers import retrieve, store
+from frontend.utils.request_helpers import client_stats as backend_client_stats
+from frontend.utils.simple_kv_helpers import retrieve, add, remove
+from frontend.utils.simple_kv_helpers import client_stats as simple_kv_client_stats
+from frontend.utils.playlist_stream import playlist_stream
 
 from .forms import SearchForm
 from . import player
 
 logger = get_logger("frontend_debug")
 
+SSE_HEARTBEAT_SECS = 15
+# Tracks shown in each page of the playlist
+PLAYLIST_PAGE_SIZE = int(os.environ.get("PLAYLIST_PAGE_SIZE", 50))
+
 
 @player.route('/', methods=['GET'])
 def index():
@@ -41,12 +52,23 @@ def search():
 @player.route("/playlist", methods=["GET"])
 def playlist():
     try:
-        user_votes = retrieve(request.remote_addr)["value"]
-        track_info_list = get("playlist").get("result", [])
+        offset = max(0, request.args.get("offset", 0, type=int))
+        # The votes can't be shown if the Simple KV failed, the playlist still can
+        try:
+            user_votes = retrieve(request.remote_addr)
+        except RuntimeError as e:
+            logger.error("Couldn't retrieve the votes of the client: %s", str(e))
+            user_votes = None
+        user_votes = user_votes["value"] if user_votes else []
+        response = get("playlist", limit=PLAYLIST_PAGE_SIZE, offset=offset)
+        track_info_list = response.get("result", [])
+        total = response.get("total", len(track_info_list))
 
         return render_template(
             "player/playlist.html", title="Democratic playlist",
             songs=track_info_list, voted_tracks=user_votes,
+            playlist_version=response.get("version"),
+            offset=offset, page_size=PLAYLIST_PAGE_SIZE, total=total,
             search_form=SearchForm())
     except RuntimeError as e:
         logger.error("Exception caught while retrieving playlist: %s", str(e))
@@ -54,12 +76,41 @@ def playlist():
         return None
 
 
+@player.route("/playlist/stream", methods=["GET"])
+def playlist_events():
+    """ Server-sent events with the changes of the playlist after version `since` """
+    queue = playlist_stream.subscribe(request.args.get("since", type=int))
+
+    def stream():
+        try:
+            while True:
+                try:
+                    message = queue.get(timeout=SSE_HEARTBEAT_SECS)
+                except Empty:
+                    # Keeps proxies from closing the connection and notices when the
+                    # client is gone
+                    yield ": heartbeat\n\n"
+                    continue
+                yield "data: {}\n\n".format(json.dumps(message))
+        finally:
+            playlist_stream.unsubscribe(queue)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache",
+                             "X-Accel-Buffering": "no"})
+
+
 @player.route("/vote/<track_id>", methods=["POST"])
 def vote(track_id):
     try:
-        if track_id not in retrieve(request.remote_addr)["value"]:
-            store(request.remote_addr, track_id)
-            post("vote", **{"track_id": track_id})
+        # Only the first vote of each client for a track counts
+        if add(request.remote_addr, track_id):
+            try:
+                post("vote", **{"track_id": track_id})
+            except RuntimeError:
+                # The vote didn't count: let the client vote for the track again
+                remove(request.remote_addr, track_id)
+                raise
         return redirect(url_for("player.playlist"))
     except RuntimeError as e:
         logger.error("Exception caught while processing vote: %s", str(e))
@@ -76,3 +127,10 @@ def play():
 def pause():
     post("pause")
     return 'I just paused it baby !'
+
+
+@player.route('/client_stats', methods=['GET'])
+def client_stats():
+    """ Latency of the requests sent by this process to the other services """
+    return jsonify({"backend": backend_client_stats(),
+                    "simple_kv": simple_kv_client_stats()})
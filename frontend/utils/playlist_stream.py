@@ -0,0 +1,129 @@
+""" Fans the changes of the playlist out to the clients subscribed to them. A single
+    thread waits for the changes on the backend no matter how many clients there are """
+from collections import deque
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+import os
+import time
+
+from frontend.utils.log import get_logger
+from frontend.utils.request_helpers import get
+
+logger = get_logger("frontend_debug")
+
+# How long each request to the backend waits for a change of the playlist
+POLL_TIMEOUT_SECS = int(os.environ.get("PLAYLIST_STREAM_POLL_TIMEOUT", 20))
+# Amount of changes kept to bring up to date the clients that subscribe late
+BUFFER_SIZE = int(os.environ.get("PLAYLIST_STREAM_BUFFER_SIZE", 100))
+# Changes waiting to be sent to a single client before it's asked to start over
+CLIENT_QUEUE_SIZE = int(os.environ.get("PLAYLIST_STREAM_CLIENT_QUEUE_SIZE", 100))
+MAX_BACKOFF_SECS = 30
+
+
+class PlaylistStream(Thread):
+    """ Waits for the changes of the playlist while there are subscribers and puts
+        each batch of them in the queue of every subscriber as {"version": ...,
+        "events": [...]}. Subscribers that can't be brought up to date get
+        {"version": ..., "reset": True} instead and should reload the playlist """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.version = None
+        # (previous version, message) ordered by version
+        self._buffer = deque(maxlen=BUFFER_SIZE)
+        self._running = False
+        self._subscribers = set()
+        self._lock = Lock()
+        self._has_subscribers = Event()
+
+    def subscribe(self, since=None):
+        """ Returns the queue where the changes after version `since` will be put """
+
+        queue = Queue(maxsize=CLIENT_QUEUE_SIZE)
+        with self._lock:
+            if not self._running:
+                self._running = True
+                self.start()
+            if self.version is None:
+                # Nobody was listening: start from where the subscriber is
+                self.version = since
+            elif since is not None and since < self.version:
+                missed = [(previous, message) for previous, message in self._buffer
+                          if message["version"] > since]
+                if missed and missed[0][0] <= since:
+                    for _, message in missed:
+                        queue.put_nowait(message)
+                else:
+                    queue.put_nowait({"version": self.version, "reset": True})
+            self._subscribers.add(queue)
+            self._has_subscribers.set()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.discard(queue)
+            if not self._subscribers:
+                self._has_subscribers.clear()
+                # Changes won't be followed until somebody subscribes again
+                self.version = None
+                self._buffer.clear()
+
+    def _broadcast(self, message, since):
+        """ Sends the message with the changes after version `since` to the
+            subscribers, unless the stream moved elsewhere meanwhile (everybody left
+            or came back from another version) """
+
+        with self._lock:
+            if self.version != since:
+                return
+            if "events" in message:
+                self._buffer.append((self.version, message))
+            else:
+                self._buffer.clear()
+            self.version = message["version"]
+            for queue in self._subscribers:
+                try:
+                    queue.put_nowait(message)
+                except Full:
+                    # Too slow to keep up: make it start over
+                    while True:
+                        try:
+                            queue.get_nowait()
+                        except Empty:
+                            break
+                    queue.put_nowait({"version": message["version"], "reset": True})
+
+    def _start_following(self, version):
+        """ Starts following the changes after `version` unless a subscriber already
+            set where to start from """
+
+        with self._lock:
+            if self.version is None and self._subscribers:
+                self.version = version
+
+    def run(self):
+        backoff = 1
+        while True:
+            self._has_subscribers.wait()
+            with self._lock:
+                since = self.version
+            try:
+                if since is None:
+                    # Only interested in the changes from now on
+                    self._start_following(
+                        get("playlist_events", since=0, timeout=0)["version"])
+                    continue
+                message = get("playlist_events",
+                              since=since, timeout=POLL_TIMEOUT_SECS)
+            except RuntimeError as exc:
+                logger.error("Waiting for playlist events failed: %s", exc)
+                time.sleep(backoff)
+                backoff = min(MAX_BACKOFF_SECS, backoff * 2)
+                continue
+            backoff = 1
+
+            if message.get("reset") or message["events"]:
+                self._broadcast(message, since)
+
+
+playlist_stream = PlaylistStream()
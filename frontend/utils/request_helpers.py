@@ -1,10 +1,11 @@
 """ Wrappers to 'requests' """
+from collections import OrderedDict
+from threading import Lock
 import os
-import time
-import json
 from urllib.parse import urlencode
-from requests import get as _get, post as _post, exceptions
+from requests import exceptions
 
+from common.http_client import HttpClient
 from frontend.utils.log import get_logger
 logger = get_logger("frontend_debug")
 
@@ -12,28 +13,25 @@ logger = get_logger("frontend_debug")
 HOST = os.environ.get("BACKEND_HOST", "127.0.0.1")
 PORT = os.environ.get("BACKEND_PORT", 9001)
 MAX_RETRIES = os.environ.get("BACKEND_MAX_RETRIES", 5)
+POOL_SIZE = int(os.environ.get("BACKEND_POOL_SIZE", 10))
 ADDR = "http://{}:{}/".format(HOST, PORT)
 
+_client = HttpClient(ADDR, pool_size=POOL_SIZE, logger=logger)
+
+# Latest response of the GET requests whose response had an ETag, so that they can be
+# sent as conditional requests: request -> (ETag, decoded response)
+ETAG_CACHE_SIZE = int(os.environ.get("BACKEND_ETAG_CACHE_SIZE", 100))
+_etag_cache = OrderedDict()
+_etag_cache_lock = Lock()
+
 
 def ping(max_retries=MAX_RETRIES):
     """ Check health """
-    while True:
-        try:
-            endpoint = ADDR + "ping"
-            r = _get(endpoint)
-            r.raise_for_status()
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "PING to backend failed after {} attempts: {}".format(
-                        5, err))
-            time.sleep(0.5)
-            max_retries -= 1
-            continue
-        except exceptions.HTTPError as err:
-            raise RuntimeError(
-                "PING to backend failed with error: {}".format(err))
-        return
+    try:
+        _client.get("ping", max_retries=max_retries)
+    except exceptions.HTTPError as err:
+        raise RuntimeError(
+            "PING to backend failed with error: {}".format(err))
 
 
 def post(backend_endpoint, max_retries=MAX_RETRIES, **payload):
@@ -41,50 +39,55 @@ def post(backend_endpoint, max_retries=MAX_RETRIES, **payload):
     if not backend_endpoint:
         raise RuntimeError(
             "When trying to make a POST request to the backend: no endpoint was provided")
-    while True:
-        try:
-            endpoint = ADDR + backend_endpoint
-            logger.debug("POST request with payload: %s", payload)
-            r = _post(endpoint, json=payload)
-            r.raise_for_status()
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "POST request to backend endpoint '{}' failed: {}".format(
-                        endpoint, err))
-            max_retries -= 1
-            time.sleep(0.5)
-            continue
-        except exceptions.HTTPError as err:
-            raise RuntimeError(
-                "Error during POST request to backend endpoint '{}': {}".format(endpoint, err))
-        logger.debug("POST response: %s", r.text)
-        return r.json() if r.text else None
+    logger.debug("POST request with payload: %s", payload)
+    try:
+        r = _client.post(backend_endpoint, max_retries=max_retries, json=payload)
+    except exceptions.HTTPError as err:
+        raise RuntimeError(
+            "Error during POST request to backend endpoint '{}': {}".format(
+                ADDR + backend_endpoint, err))
+    logger.debug("POST response: %s", r.text)
+    return r.json() if r.text else None
 
 
 def get(backend_endpoint, max_retries=MAX_RETRIES, **payload):
-    """ Send GET request to the backend """
+    """ Send GET request to the backend. In case the backend tagged the previous
+        response to the same request with an ETag, the request is a conditional one
+        and that response is returned again when it's still current. Responses can
+        therefore be shared and mustn't be modified """
     if not backend_endpoint:
         raise RuntimeError(
             "When trying to make a GET request to the backend: no endpoint was provided")
 
-    while True:
-        try:
-            endpoint = ADDR + backend_endpoint
-            logger.debug("Get payload: %s", urlencode(payload))
-            r = _get(endpoint, params=urlencode(payload))
-            r.raise_for_status()
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "GET request to backend endpoint '{}' failed: {}".format(
-                        endpoint, err))
-            max_retries -= 1
-            time.sleep(0.5)
-            continue
-        except exceptions.HTTPError as err:
-            raise RuntimeError(
-                "Error during GET request to backend endpoint '{}': {}".format(
-                    endpoint, err))
-        logger.debug("Get response: %s", r.text)
-        return r.json() if r.text else None
+    params = urlencode(payload)
+    logger.debug("Get payload: %s", params)
+    request_key = backend_endpoint + "?" + params
+    with _etag_cache_lock:
+        cached = _etag_cache.get(request_key)
+    headers = {"If-None-Match": cached[0]} if cached is not None else {}
+    try:
+        r = _client.get(backend_endpoint, max_retries=max_retries, params=params,
+                        headers=headers)
+    except exceptions.HTTPError as err:
+        raise RuntimeError(
+            "Error during GET request to backend endpoint '{}': {}".format(
+                ADDR + backend_endpoint, err))
+    if r.status_code == 304 and cached is not None:
+        logger.debug("Get response not modified")
+        return cached[1]
+
+    logger.debug("Get response: %s", r.text)
+    response = r.json() if r.text else None
+    etag = r.headers.get("ETag")
+    if etag is not None:
+        with _etag_cache_lock:
+            _etag_cache.pop(request_key, None)
+            _etag_cache[request_key] = (etag, response)
+            if len(_etag_cache) > ETAG_CACHE_SIZE:
+                _etag_cache.popitem(last=False)
+    return response
+
+
+def client_stats():
+    """ Returns the latency histograms of the requests sent to the backend """
+    return _client.stats()
@@ -1,83 +1,133 @@
 """ Utility functions to send requests to the Simple KV """
 import os
-import time
 from urllib.parse import urlencode
-from requests import get, post, exceptions
+from requests import exceptions
 
+from common.http_client import HttpClient
+from common.simple_kv_shards import HashRing, SHARD_URLS
 from frontend.utils.log import get_logger
 
 logger = get_logger("frontend_debug")
 
-SIMPLE_KV_HOST = os.environ.get("SIMPLE_KV_HOST", "simple_kv")
-SIMPLE_KV_PORT = os.environ.get("SIMPLE_KV_PORT", 5002)
 MAX_RETRIES = os.environ.get("SIMPLE_KV_MAX_RETRIES", 5)
-SIMPLE_KV_URL = "http://{}:{}".format(SIMPLE_KV_HOST, SIMPLE_KV_PORT)
+POOL_SIZE = int(os.environ.get("SIMPLE_KV_POOL_SIZE", 10))
+
+_ring = HashRing(SHARD_URLS)
+
+# Shared by every thread so that connections to the Simple KV are kept open and
+# reused instead of paying for a new one on each request
+_client = HttpClient(pool_connections=len(SHARD_URLS), pool_size=POOL_SIZE,
+                     logger=logger)
+
+
+def _shard_url(key):
+    """ Returns the URL of the shard that holds the given key """
+    return _ring.node_for(key)
+
+
+def _error_message(err):
+    msg = str(err)
+    if err.response is not None:
+        msg = msg + ". Response body: " + err.response.text
+    return msg
 
 
 def ping(max_retries=MAX_RETRIES):
-    while True:
+    for url in SHARD_URLS:
+        logger.debug("Pinging the simpleKV to %s", url)
         try:
-            logger.debug("Pinging the simpleKV to %s:%s",
-                         SIMPLE_KV_HOST, SIMPLE_KV_PORT)
-            r = get(SIMPLE_KV_URL + "/ping")
-            r.raise_for_status()
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "PING to simple-kv failed after {} attempts: {}".format(
-                        5, err))
-            time.sleep(0.5)
-            max_retries -= 1
-            continue
+            _client.get(url + "/ping", max_retries=max_retries)
         except exceptions.HTTPError as err:
             raise RuntimeError(
                 "PING to simple-kv failed with error: {}".format(err))
-        return
 
 
 def store(key, value, max_retries=MAX_RETRIES):
-    while True:
-        try:
-            r = post(
-                SIMPLE_KV_URL,
-                json={"key": key, "value": value, "action": "create"})
-            r.raise_for_status()
-            return r.json() if r.text else None
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "POST request to simple-kv endpoint '{}' failed: {}".format(
-                        SIMPLE_KV_URL, err))
-            max_retries -= 1
-            time.sleep(0.5)
-            continue
-        except exceptions.HTTPError as e:
-            msg = str(e)
-            if e.response is not None:
-                msg = msg + ". Response body: " + e.response.text
-            logger.error(
-                "Error while storing value in simple-kv: %s", msg)
+    try:
+        r = _client.post(
+            _shard_url(key), max_retries=max_retries,
+            json={"key": key, "value": value, "action": "create"})
+        return r.json() if r.text else None
+    except exceptions.HTTPError as e:
+        logger.error(
+            "Error while storing value in simple-kv: %s", _error_message(e))
 
 
 def retrieve(key, max_retries=MAX_RETRIES):
-    while True:
-        try:
-            r = get(SIMPLE_KV_URL, params=urlencode({"key": key}))
-            r.raise_for_status()
-            return r.json() if r.text else None
-        except (exceptions.ConnectionError, exceptions.ConnectTimeout) as err:
-            if max_retries == 0:
-                raise RuntimeError(
-                    "GET request to simple-kv endpoint '{}' failed: {}".format(
-                        SIMPLE_KV_URL, err))
-            max_retries -= 1
-            time.sleep(0.5)
-            continue
-        except exceptions.HTTPError as e:
-            msg = str(e)
-            if e.response is not None:
-                msg = msg + ". Response body: " + e.response.text
-            logger.error(
-                "Error while retrieving from simple-kv: %s", msg)
-
-    return ping, store, retrieve
+    try:
+        r = _client.get(
+            _shard_url(key), max_retries=max_retries,
+            params=urlencode({"key": key}))
+        return r.json() if r.text else None
+    except exceptions.HTTPError as e:
+        logger.error(
+            "Error while retrieving from simple-kv: %s", _error_message(e))
+
+
+def _post_json(url, payload, max_retries):
+    """ Sends a POST request with the given JSON payload to the shard at `url` and
+        returns the JSON response """
+    try:
+        r = _client.post(url, max_retries=max_retries, json=payload)
+        return r.json() if r.text else None
+    except exceptions.HTTPError as e:
+        raise RuntimeError(
+            "Error during '{}' request to simple-kv: {}".format(
+                payload["action"], _error_message(e)))
+
+
+def client_stats():
+    """ Returns the latency histograms of the requests sent to the Simple KV """
+    return _client.stats()
+
+
+def add(key, value, max_retries=MAX_RETRIES):
+    """ Atomically associates `value` to `key` unless it already was. Returns whether
+        the value was added """
+    return _post_json(
+        _shard_url(key),
+        {"key": key, "value": value, "action": "add"}, max_retries)["added"]
+
+
+def remove(key, value, max_retries=MAX_RETRIES):
+    """ Removes `value` from `key` only """
+    _post_json(_shard_url(key),
+               {"key": key, "value": value, "action": "remove"}, max_retries)
+
+
+def multi_get(keys, max_retries=MAX_RETRIES):
+    """ Returns a list with the values associated to each one of the `keys`. Sends a
+        single request to each one of the shards involved """
+    groups = {}
+    for position, key in enumerate(keys):
+        groups.setdefault(_shard_url(key), []).append((position, key))
+
+    values = [None] * len(keys)
+    for url, group in groups.items():
+        response = _post_json(
+            url, {"keys": [key for _, key in group], "action": "multi_get"},
+            max_retries)
+        for (position, _), item in zip(group, response["result"]):
+            values[position] = item["value"]
+    return values
+
+
+def batch(operations, max_retries=MAX_RETRIES):
+    """ Applies a list of operations ({"action": create|add|remove|delete|get,
+        "key": ..., "value": ...}) and returns the list of their results. The
+        operations sent to the same shard are applied atomically, deletes are sent to
+        every shard """
+    groups = {}
+    for position, op in enumerate(operations):
+        urls = SHARD_URLS if op["action"] == "delete" else [_shard_url(op["key"])]
+        for url in urls:
+            groups.setdefault(url, []).append((position, op))
+
+    results = [None] * len(operations)
+    for url, group in groups.items():
+        response = _post_json(
+            url, {"operations": [op for _, op in group], "action": "batch"},
+            max_retries)
+        for (position, _), result in zip(group, response["result"]):
+            results[position] = result
+    return results
@@ -0,0 +1,58 @@
+""" Latency benchmark of the requests to SimpleKV: a new connection per request (as the
+    helpers used to do) against the pooled keep-alive client they use now.
+
+    Run from the root of the repository:
+        PYTHONPATH=. python simple_kv/bench/connection_latency.py [requests] 2>/dev/null
+
+    (the server logs every request to stderr)
+"""
+
+from threading import Thread
+import sys
+import time
+
+import requests
+
+from common.http_client import HttpClient
+from simple_kv.main import Handler, ThreadedServer
+
+
+def measure(send, url, n_requests):
+    """ Alternates adding a vote and reading the votes of a client """
+    latencies = []
+    for i in range(n_requests):
+        key = "10.0.{}.{},votes".format(i // 256 % 256, i % 256)
+        started = time.perf_counter()
+        if i % 2:
+            send("GET", url, params={"key": key})
+        else:
+            send("POST", url, json={"key": key, "value": "spotify:track:{}".format(i),
+                                    "action": "add"})
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return (latencies[len(latencies) // 2], sum(latencies) / len(latencies),
+            latencies[int(len(latencies) * 0.99)])
+
+
+def main(n_requests):
+    server = ThreadedServer(("localhost", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://localhost:{}".format(server.server_address[1])
+
+    def per_request(method, url, **kwargs):
+        requests.request(method, url, **kwargs).raise_for_status()
+
+    client = HttpClient()
+
+    print("{} alternating add/get requests".format(n_requests))
+    print("{:<26}{:>8}{:>9}{:>8}".format("", "p50 ms", "mean ms", "p99 ms"))
+    for name, send in [("new connection per request", per_request),
+                       ("pooled keep-alive client", client.request)]:
+        measure(send, url, 100)  # Warm up
+        print("{:<26}{:>8.2f}{:>9.2f}{:>8.2f}".format(
+            name, *measure(send, url, n_requests)))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,87 @@
+""" Benchmark of deleting a value from SimpleKV with 100k keys, compared to scanning
+    every key as before the reverse index. Also checks that the index stays consistent
+    with the keys after concurrent stores and deletes.
+
+    Run from the root of the repository:
+        PYTHONPATH=. python simple_kv/bench/delete_index.py [keys]
+"""
+
+from threading import Thread
+import random
+import sys
+import time
+
+from simple_kv.main import SimpleKV
+
+TRACKS = 1000
+VOTES_PER_KEY = 3
+
+
+def scan_delete(kv, value):
+    """ The previous delete: discards the value from the set of every key """
+    with kv.rw_lock.write():
+        for key in list(kv.db):
+            values = kv.db[key]
+            values.discard(value)
+            if not values:
+                del kv.db[key]
+
+
+def fill(kv, n_keys):
+    # Every key (a client) voted for a few of the tracks
+    for i in range(n_keys):
+        key = ("10.0.{}.{}".format(i // 256, i % 256), "votes")
+        for track in random.sample(range(TRACKS), VOTES_PER_KEY):
+            kv._store(key, "spotify:track:{}".format(track))
+
+
+def per_op_us(delete, kv, values):
+    started = time.perf_counter()
+    for value in values:
+        delete(kv, value)
+    return (time.perf_counter() - started) / len(values) * 1e6
+
+
+def check_consistency(threads=8, ops=5000):
+    kv = SimpleKV()
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        for _ in range(ops):
+            value = "spotify:track:{}".format(rnd.randrange(50))
+            if rnd.random() < 0.8:
+                kv.store(("10.0.0.{}".format(rnd.randrange(200)), "votes"), value)
+            else:
+                kv.delete(value)
+
+    workers = [Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    from_keys = {}
+    for key, values in kv.db.items():
+        for value in values:
+            from_keys.setdefault(value, set()).add(key)
+    index = {value: keys for value, keys in kv.keys_by_value.items() if keys}
+    return from_keys == index
+
+
+def main(n_keys):
+    random.seed(1)
+    values = ["spotify:track:{}".format(t) for t in random.sample(range(TRACKS), 100)]
+
+    print("{} keys with {} values each out of {}".format(n_keys, VOTES_PER_KEY, TRACKS))
+    for name, delete in [("scan", scan_delete), ("index", SimpleKV.delete)]:
+        kv = SimpleKV()
+        fill(kv, n_keys)
+        us = per_op_us(delete, kv, values)
+        print("{:<6} delete: {:>9.1f} us/op".format(name, us))
+
+    print("Index consistent after concurrent stores and deletes: {}".format(
+        check_consistency()))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,115 @@
+""" Throughput of SimpleKV as shards are added. Starts every shard as its own server
+    process and several client processes that add votes and read them back through
+    the frontend helpers, which route each key to its shard, for each amount of shards.
+
+    Run from the root of the repository:
+        PYTHONPATH=$PWD python simple_kv/bench/shard_scaling.py [shards] [clients] [secs]
+
+    `shards` is a comma separated list of the amounts of shards to try (1,2,4 by
+    default). Shards only add throughput when there are spare cores for them: the
+    amount of cores of the host is printed along with the results
+"""
+
+from collections import Counter
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+import requests
+
+BASE_PORT = 18700
+
+
+def start_shards(n_shards):
+    servers = []
+    for i in range(n_shards):
+        env = dict(os.environ, SIMPLE_KV_HOST="127.0.0.1",
+                   SIMPLE_KV_PORT=str(BASE_PORT + i))
+        servers.append(subprocess.Popen(
+            [sys.executable, "-m", "simple_kv.main"], env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    # Wait until all of them accept requests
+    for i in range(n_shards):
+        url = "http://127.0.0.1:{}/ping".format(BASE_PORT + i)
+        for _ in range(100):
+            try:
+                requests.get(url, timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.05)
+        else:
+            stop_shards(servers)
+            raise RuntimeError("Shard {} didn't start".format(i))
+    return servers
+
+
+def stop_shards(servers):
+    for server in servers:
+        server.terminate()
+    for server in servers:
+        server.wait()
+
+
+def client(seed, secs, results):
+    """ Adds a vote for a random client and then reads its votes until `secs` pass.
+        Runs in its own process, with SIMPLE_KV_SHARDS already in its environment """
+    from frontend.utils.simple_kv_helpers import add, retrieve, _shard_url
+
+    rnd = random.Random(seed)
+    operations = 0
+    shards = Counter()
+    deadline = time.monotonic() + secs
+    while time.monotonic() < deadline:
+        key = "10.{}.{}.{}".format(seed, rnd.randrange(256), rnd.randrange(256))
+        add(key, "spotify:track:{}".format(rnd.randrange(1000)))
+        retrieve(key)
+        operations += 2
+        shards[_shard_url(key)] += 2
+    results.put((operations, shards))
+
+
+def run(n_shards, n_clients, secs):
+    servers = start_shards(n_shards)
+    try:
+        # The helpers read the shards from the environment when they're imported
+        os.environ["SIMPLE_KV_SHARDS"] = ",".join(
+            "127.0.0.1:{}".format(BASE_PORT + i) for i in range(n_shards))
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        clients = [context.Process(target=client, args=(seed, secs, results))
+                   for seed in range(n_clients)]
+        for process in clients:
+            process.start()
+        totals = [results.get() for _ in clients]
+        for process in clients:
+            process.join()
+    finally:
+        stop_shards(servers)
+
+    operations = sum(ops for ops, _ in totals)
+    shards = sum((s for _, s in totals), Counter())
+    share = "/".join("{:.0f}".format(100 * shards[url] / operations)
+                     for url in sorted(shards))
+    return operations / secs, share
+
+
+def main(shard_counts, n_clients, secs):
+    print("{} client processes, {}s per run, {} cores".format(
+        n_clients, secs, os.cpu_count()))
+    print("{:>7}{:>10}{:>10}  {}".format("shards", "ops/s", "speedup", "% per shard"))
+    baseline = None
+    for n_shards in shard_counts:
+        rate, share = run(n_shards, n_clients, secs)
+        baseline = baseline or rate
+        print("{:>7}{:>10.0f}{:>9.2f}x  {}".format(
+            n_shards, rate, rate / baseline, share))
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else [1, 2, 4],
+         int(sys.argv[2]) if len(sys.argv) > 2 else 8,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 5)
@@ -0,0 +1,31 @@
+""" Background expiration of the keys of the kv storage whose TTL elapsed """
+
+from threading import Event, Thread
+
+from simple_kv.utils import get_logger
+
+logger = get_logger("simple_kv")
+
+
+class ExpirySweeper(Thread):
+    """ Periodically drops the expired keys of the storage. Each run only looks at the
+        keys that actually expired, so its cost doesn't depend on the size of the
+        storage """
+
+    def __init__(self, kv, interval_secs):
+        super().__init__(daemon=True)
+        self._kv = kv
+        self._interval_secs = interval_secs
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval_secs):
+            try:
+                expired = self._kv.expire()
+                if expired:
+                    logger.debug("Dropped %s expired keys", expired)
+            except Exception as exc:
+                logger.error("Expiring keys failed: %s", exc)
+
+    def stop(self):
+        self._stopped.set()
@@ -1,53 +1,347 @@
 """ Very simple key value storage with HTTP interface and support for the following
-    operations: get, set. It's thread safe by means of locks """
+    operations: get, set, add (set only if absent) and batches of them. It's thread
+    safe by means of locks """
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 from urllib.parse import urlsplit, parse_qs
-from threading import Lock
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from functools import lru_cache
+import heapq
 import json
 import os
+import sys
+import time
 
-from simple_kv.utils import get_logger
+from simple_kv.expiry import ExpirySweeper
+from simple_kv.persistence import Journal, Snapshotter
+from simple_kv.utils import get_logger, ReadWriteLock
 
 logger = get_logger("simple_kv")
 
 HOST = os.environ.get("SIMPLE_KV_HOST", "0.0.0.0")
 PORT = int(os.environ.get("SIMPLE_KV_PORT", 5002))
 MULTIFIELD_KEY_SEPARATOR = os.environ.get("MULTIFIELD_KEY_SEPARATOR", ",")
+KEY_CACHE_SIZE = int(os.environ.get("SIMPLE_KV_KEY_CACHE_SIZE", 4096))
+# Persistence is only enabled when a data directory is given
+DATA_DIR = os.environ.get("SIMPLE_KV_DATA_DIR")
+GROUP_COMMIT_MS = int(os.environ.get("SIMPLE_KV_GROUP_COMMIT_MS", 1))
+SNAPSHOT_INTERVAL_SECS = int(os.environ.get("SIMPLE_KV_SNAPSHOT_INTERVAL_SECS", 300))
+# Keys copied for the snapshot each time the storage is locked
+SNAPSHOT_COPY_BATCH_SIZE = 1000
+# Keys expire this long after they were last written to. 0 disables expiration
+KEY_TTL_SECS = float(os.environ.get("SIMPLE_KV_KEY_TTL_SECS", 0))
+EXPIRY_SWEEP_INTERVAL_SECS = float(
+    os.environ.get("SIMPLE_KV_EXPIRY_SWEEP_INTERVAL_SECS", 1))
+# The least recently written keys are evicted above this estimated size. 0 disables it
+MAX_MEMORY_BYTES = int(os.environ.get("SIMPLE_KV_MAX_MEMORY_BYTES", 0))
 
 
 class SimpleKV:
-    """ Thread-safe key-value storage exposing 2 operations: `store` and `retrieve` """
-
-    def __init__(self):
-        self.db = defaultdict(set)
-        self.rw_lock = Lock()
-
-    def store(self, key, value):
-        """ Associates the given value to the given key """
-        with self.rw_lock:
-            self.db[key].add(value)
+    """ Thread-safe key-value storage exposing 2 operations: `store` and `retrieve`.
+        Keys expire `ttl` seconds after they were last written to (if given) and, in
+        case `max_memory_bytes` is given, the least recently written keys are evicted
+        to keep the estimated memory used by the storage under it """
+
+    def __init__(self, journal=None, default_ttl=None, max_memory_bytes=None):
+        self.db = {}
+        # Reverse index (value -> keys) so deleting a value doesn't scan every key
+        self.keys_by_value = defaultdict(set)
+        self.rw_lock = ReadWriteLock()
+        self.journal = journal
+        self.default_ttl = default_ttl
+        self.max_memory_bytes = max_memory_bytes
+
+        self.memory_bytes = 0
+        # Keys ordered from the least to the most recently written one
+        self.write_order = OrderedDict()
+        self.expires_at = {}
+        # (expires_at, key) of the keys with a TTL. Entries are left behind when the
+        # expiration of a key changes and skipped once they reach the top
+        self.expiry_heap = []
+        self.expired = 0
+        self.evicted = 0
+
+        if journal is not None:
+            journal.recover(self._restore, self._delete, self._drop, self._remove)
+            # Keys that expired while the storage was down
+            self.expire()
+            with self.rw_lock.write():
+                seq = self._evict()
+            if seq is not None:
+                journal.wait(seq)
+
+    def _store(self, key, value, ttl=None):
+        values = self.db.get(key)
+        if values is None:
+            values = self.db[key] = set()
+            self.memory_bytes += sizeof_key(key)
+        if value not in values:
+            values.add(value)
+            self.keys_by_value[value].add(key)
+            self.memory_bytes += sys.getsizeof(value)
+
+        self.write_order.pop(key, None)
+        self.write_order[key] = None
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl:
+            expires_at = time.monotonic() + ttl
+            self.expires_at[key] = expires_at
+            heapq.heappush(self.expiry_heap, (expires_at, key))
+        else:
+            self.expires_at.pop(key, None)
+
+    def _restore(self, key, value, *expires_at):
+        """ Replays a store read from the journal. `expires_at` is the wall clock time
+            the key expires at (None if it doesn't). Records written before TTLs were
+            journaled lack it and get the default TTL """
+        if not expires_at:
+            self._store(key, value)
+        elif expires_at[0] is None:
+            self._store(key, value, ttl=0)
+        else:
+            # The expiration is kept even if it already passed: the sweep after the
+            # recovery drops the key unless a later record writes to it again
+            self._store(key, value, ttl=0)
+            expires_at = time.monotonic() + expires_at[0] - time.time()
+            self.expires_at[key] = expires_at
+            heapq.heappush(self.expiry_heap, (expires_at, key))
+
+    def _wall_expires_at(self, key):
+        """ Returns the wall clock time the key expires at, or None if it doesn't """
+        expires_at = self.expires_at.get(key)
+        if expires_at is None:
+            return None
+        return time.time() + expires_at - time.monotonic()
+
+    def _delete(self, value):
+        for key in self.keys_by_value.pop(value, ()):
+            values = self.db[key]
+            values.discard(value)
+            self.memory_bytes -= sys.getsizeof(value)
+            if not values:
+                self._drop(key)
+
+    def _remove(self, key, value):
+        """ Removes the value from the key, dropping the key if it was the last one """
+        values = self.db.get(key)
+        if values is None or value not in values:
+            return
+        values.discard(value)
+        keys = self.keys_by_value[value]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_value[value]
+        self.memory_bytes -= sys.getsizeof(value)
+        if not values:
+            self._drop(key)
+
+    def _drop(self, key):
+        """ Removes the key along with all its values """
+        values = self.db.pop(key, None)
+        if values is None:
+            return
+        for value in values:
+            keys = self.keys_by_value[value]
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_value[value]
+            self.memory_bytes -= sys.getsizeof(value)
+        self.memory_bytes -= sizeof_key(key)
+        self.write_order.pop(key, None)
+        self.expires_at.pop(key, None)
+
+    def _drop_logged(self, key):
+        self._drop(key)
+        if self.journal is not None:
+            return self.journal.write(["drop", list(key)])
+
+    def _is_expired(self, key, now=None):
+        expires_at = self.expires_at.get(key)
+        return expires_at is not None and expires_at <= (now or time.monotonic())
+
+    def _values(self, key):
+        """ Returns the values of the key or an empty set if it's missing or expired """
+        values = self.db.get(key)
+        if values is None or self._is_expired(key):
+            return frozenset()
+        return values
+
+    def _evict(self):
+        """ Drops the least recently written keys while the storage uses more memory
+            than allowed. Returns the sequence number of the last journal record """
+        seq = None
+        while (self.max_memory_bytes and self.memory_bytes > self.max_memory_bytes
+               and self.write_order):
+            key = next(iter(self.write_order))
+            seq = self._drop_logged(key)
+            self.evicted += 1
+        return seq
+
+    def store(self, key, value, ttl=None):
+        """ Associates the given value to the given key. Returns once it's durable in
+            case there's a journal """
+        self.batch([("create", key, value)], ttl)
 
     def retrieve(self, key):
-        """ Returns the set of values associated to the given `key`. Returns `None` in case
-            the key has no elements associated to it"""
-        with self.rw_lock:
-            return self.db.get(key)
+        """ Returns a copy of the set of values associated to the given `key`. Returns
+            `None` in case the key has no elements associated to it. Retrievals don't
+            block each other """
+        with self.rw_lock.read():
+            values = self._values(key)
+            return frozenset(values) if values else None
 
     def delete(self, value):
         """ Deletes the specified value from all the associated keys """
-        with self.rw_lock:
-            for v in self.db.values():
-                v.discard(value)
-
-
-db = SimpleKV()
+        self.batch([("delete", None, value)])
+
+    def remove(self, key, value):
+        """ Removes the given value from the given key only """
+        self.batch([("remove", key, value)])
+
+    def add(self, key, value, ttl=None):
+        """ Associates the given value to the given key unless it already was. Returns
+            whether the value was added """
+        return self.batch([("add", key, value)], ttl)[0]
+
+    def multi_retrieve(self, keys):
+        """ Returns a list with a copy of the set of values of each one of the `keys` """
+        with self.rw_lock.read():
+            return [frozenset(self._values(key)) for key in keys]
+
+    def batch(self, operations, ttl=None):
+        """ Atomically applies a list of (action, key, value) operations, where action
+            is one of: create, add, remove, delete (key is ignored) or get (value is
+            ignored). `ttl` overrides the default one of the keys written by the batch.
+            Returns the list with the result of each operation: None for create, remove
+            and delete, whether the value was added for add and the values for get """
+        results = []
+        seq = None
+        with self.rw_lock.write():
+            for action, key, value in operations:
+                result = None
+                if action == "get":
+                    result = frozenset(self._values(key))
+                elif action == "delete":
+                    self._delete(value)
+                    if self.journal is not None:
+                        seq = self.journal.write(["delete", value])
+                elif action == "remove":
+                    self._remove(key, value)
+                    if self.journal is not None:
+                        seq = self.journal.write(["remove", list(key), value])
+                elif action == "create" or value not in self._values(key):
+                    if self._is_expired(key):
+                        seq = self._drop_logged(key) or seq
+                    self._store(key, value, ttl)
+                    if self.journal is not None:
+                        seq = self.journal.write(
+                            ["store", list(key), value, self._wall_expires_at(key)])
+                    result = True if action == "add" else None
+                else:  # Adding a value that was already there
+                    had_ttl = key in self.expires_at
+                    self._store(key, value, ttl)  # Still counts as a write
+                    if self.journal is not None and (had_ttl or key in self.expires_at):
+                        # Only its expiration changed (or it was removed)
+                        seq = self.journal.write(
+                            ["store", list(key), value, self._wall_expires_at(key)])
+                    result = False
+                results.append(result)
+            seq = self._evict() or seq
+        if seq is not None:
+            self.journal.wait(seq)
+        return results
+
+    def expire(self):
+        """ Drops the keys whose TTL elapsed. Returns how many of them were dropped """
+        now = time.monotonic()
+        expired = 0
+        seq = None
+        with self.rw_lock.write():
+            heap = self.expiry_heap
+            while heap and heap[0][0] <= now:
+                expires_at, key = heapq.heappop(heap)
+                if self.expires_at.get(key) == expires_at:
+                    seq = self._drop_logged(key)
+                    expired += 1
+            # Keys rewritten over and over leave many stale entries behind
+            if len(heap) > 2 * len(self.expires_at) + 1024:
+                self.expiry_heap = [(t, k) for k, t in self.expires_at.items()]
+                heapq.heapify(self.expiry_heap)
+            self.expired += expired
+        if seq is not None:
+            self.journal.wait(seq)
+        return expired
+
+    def stats(self):
+        """ Returns the size, estimated memory usage and counters of the storage """
+        with self.rw_lock.read():
+            return {
+                "keys": len(self.db),
+                "values": len(self.keys_by_value),
+                "memory_bytes": self.memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "keys_with_ttl": len(self.expires_at),
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+    def snapshot(self):
+        """ Writes a compacted snapshot of the storage and drops the log preceding it.
+            The storage is copied in batches, so neither readers nor writers wait for
+            the whole copy. Changes applied after the rotation may make it into the
+            copy, which is fine: replaying their records from the new log over it
+            gives the same result, since every record sets the values it's about
+            regardless of what was there before """
+        with self.rw_lock.write():
+            generation = self.journal.rotate()
+        with self.rw_lock.read():
+            keys = list(self.db)
+        items = []
+        for start in range(0, len(keys), SNAPSHOT_COPY_BATCH_SIZE):
+            with self.rw_lock.read():
+                for key in keys[start:start + SNAPSHOT_COPY_BATCH_SIZE]:
+                    values = self._values(key)
+                    if values:
+                        items.append((key, list(values), self._wall_expires_at(key)))
+        self.journal.write_snapshot(items, generation)
+
+
+def sizeof_key(key):
+    """ Estimation of the memory used by a key and its (empty) set of values """
+    return (sys.getsizeof(key) + sum(sys.getsizeof(field) for field in key)
+            + _EMPTY_SET_SIZE)
+
+
+_EMPTY_SET_SIZE = sys.getsizeof(set())
+
+
+db = SimpleKV(Journal(DATA_DIR, GROUP_COMMIT_MS) if DATA_DIR else None,
+              default_ttl=KEY_TTL_SECS or None,
+              max_memory_bytes=MAX_MEMORY_BYTES or None)
+
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    """Handle requests in a separate thread"""
+
+    daemon_threads = True
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def parse_key(raw_key):
+    """ Returns the tuple of fields of a key as sent by the clients """
+    return tuple(raw_key.split(MULTIFIELD_KEY_SEPARATOR))
 
 
 class Handler(BaseHTTPRequestHandler):
     """Request handler for the kv storage. Through a simple API gives access to
        the supported operations: get, set """
 
+    # Clients keep their connections open between requests, which requires every
+    # response to have a Content-Length
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately: don't let Nagle hold the latter back
+    disable_nagle_algorithm = True
+
     def do_GET(self):
         """Handles retrieval of info from the storage"""
 
@@ -69,14 +363,19 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.write(b"PONG")
             return
 
+        if path.lower().endswith("stats"):
+            self.output_json(db.stats())
+            return
+
         raw_key = parse_qs(query).get("key")
         if raw_key is None:
             self.send_response(400)
+            self.send_header("Content-Length", "0")
             self.end_headers()
             return
 
         raw_key = raw_key[0]
-        key_as_tuple = tuple(raw_key.split(MULTIFIELD_KEY_SEPARATOR))
+        key_as_tuple = parse_key(raw_key)
         value_set = db.retrieve(key_as_tuple) or []
 
         # if value_set is None:
@@ -109,18 +408,43 @@ class Handler(BaseHTTPRequestHandler):
             logger.info("POST request body: %s", content)
 
             action = content["action"]
-            if action not in ["create", "delete"]:
+            if action not in ["create", "delete", "add", "remove", "multi_get",
+                              "batch"]:
                 self.output_error(
                     **{"reason": "Invalid action {}".format(action)})
             elif action == "create":
-                key = tuple(content["key"].split(MULTIFIELD_KEY_SEPARATOR))
+                key = parse_key(content["key"])
                 value = content["value"]
-                db.store(key, value)
+                db.store(key, value, content.get("ttl"))
                 self.send_response(201)
+                self.send_header("Content-Length", "0")
                 self.end_headers()
+            elif action == "add":
+                key = parse_key(content["key"])
+                added = db.add(key, content["value"], content.get("ttl"))
+                self.output_json({"key": content["key"], "added": added})
+            elif action == "remove":
+                db.remove(parse_key(content["key"]), content["value"])
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            elif action == "multi_get":
+                raw_keys = content["keys"]
+                value_sets = db.multi_retrieve(
+                    [parse_key(k) for k in raw_keys])
+                self.output_json({"result": [
+                    {"key": raw_key, "value": list(value_set)}
+                    for raw_key, value_set in zip(raw_keys, value_sets)]})
+            elif action == "batch":
+                operations = self.parse_operations(content["operations"])
+                if operations is not None:
+                    results = db.batch(operations, content.get("ttl"))
+                    self.output_json({"result": [
+                        list(r) if isinstance(r, frozenset) else r for r in results]})
             else:  # action == "delete"
                 db.delete(content["value"])
                 self.send_response(204)
+                self.send_header("Content-Length", "0")
                 self.end_headers()
 
         except json.JSONDecodeError as e:
@@ -129,6 +453,29 @@ class Handler(BaseHTTPRequestHandler):
             self.output_error(
                 **{"reason": "Missing mandatory field {}".format(str(e))})
 
+    def parse_operations(self, raw_operations):
+        """ Returns the [(action, key, value)] from the operations of a batch request.
+            Outputs an error and returns None in case any of them is invalid """
+        operations = []
+        for op in raw_operations:
+            action = op["action"]
+            if action not in ["create", "add", "remove", "delete", "get"]:
+                self.output_error(
+                    **{"reason": "Invalid batch action {}".format(action)})
+                return None
+            key = parse_key(op["key"]) if action != "delete" else None
+            value = op["value"] if action != "get" else None
+            operations.append((action, key, value))
+        return operations
+
+    def output_json(self, obj, code=200):
+        content = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", len(content))
+        self.end_headers()
+        self.wfile.write(content)
+
     def output_error(self, error_code=400, **kwargs):
         msg = json.dumps(kwargs).encode()
         self.send_response(error_code)
@@ -140,7 +487,16 @@ class Handler(BaseHTTPRequestHandler):
 
 if __name__ == '__main__':
     address = (HOST, PORT)
-    server = HTTPServer(address, Handler)
+    server = ThreadedServer(address, Handler)
+
+    snapshotter = None
+    if db.journal is not None:
+        snapshotter = Snapshotter(db, SNAPSHOT_INTERVAL_SECS)
+        snapshotter.start()
+
+    # Always running since keys can be given a TTL on their own
+    sweeper = ExpirySweeper(db, EXPIRY_SWEEP_INTERVAL_SECS)
+    sweeper.start()
 
     try:
         logger.info("simple KV listening in HOST %s and PORT %s", HOST, PORT)
@@ -148,3 +504,7 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logger.info("Shutting down the kv-storage...")
         server.shutdown()
+        sweeper.stop()
+        if snapshotter is not None:
+            snapshotter.stop()
+            db.journal.close()
@@ -0,0 +1,235 @@
+""" Optional persistence of the kv storage: an append-only log of the operations that
+    is fsync'ed in groups plus periodic snapshots that allow compacting it """
+
+from threading import Condition, Event, Lock, Thread
+import json
+import mmap
+import os
+import re
+import time
+
+from simple_kv.utils import get_logger
+
+logger = get_logger("simple_kv")
+
+SNAPSHOT_FILE = "snapshot"
+LOG_FILE_FMT = "log.{:08d}"
+LOG_FILE_REGEX = re.compile(r"^log\.(\d{8})$")
+
+
+class Journal:
+    """ Append-only log of the operations applied to the storage. Records are
+        serialized by `write` in the order the storage applies them and become durable
+        once `wait` returns. Neither of them does any I/O while the storage is locked:
+        `write` only buffers the record and the write and fsync happen in `wait` (or in
+        a background flusher with `group_commit_ms` > 0, which lets the records written
+        within that window share a single fsync) """
+
+    def __init__(self, data_dir, group_commit_ms=0):
+        self.data_dir = data_dir
+        self.group_commit_ms = group_commit_ms
+        os.makedirs(data_dir, exist_ok=True)
+
+        self.generation = 0
+        self._file = None
+        self._cond = Condition()
+        # Held while writing to the file. Never taken while holding the condition
+        self._file_lock = Lock()
+        self._pending = []
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._closed = False
+        self._flusher = None
+
+    def _log_path(self, generation):
+        return os.path.join(self.data_dir, LOG_FILE_FMT.format(generation))
+
+    def _log_generations(self):
+        generations = []
+        for name in os.listdir(self.data_dir):
+            match = LOG_FILE_REGEX.match(name)
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    def recover(self, store, delete, drop, remove):
+        """ Replays the snapshot and the logs written after it by calling
+            `store(key, value[, expires_at])`, `delete(value)`, `drop(key)` and
+            `remove(key, value)`, then opens the log for appending. `expires_at` is the
+            wall clock time the key expires at (None if it doesn't) and is missing from
+            older records """
+
+        snapshot_generation = 0
+        snapshot_path = os.path.join(self.data_dir, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path) and os.path.getsize(snapshot_path):
+            with open(snapshot_path, "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                snapshot_generation = json.loads(mm.readline())["generation"]
+                for line in iter(mm.readline, b""):
+                    key, values, *expires_at = json.loads(line)
+                    for value in values:
+                        store(tuple(key), value, *expires_at)
+
+        replayed = 0
+        generations = [g for g in self._log_generations() if g >= snapshot_generation]
+        for generation in generations:
+            with open(self._log_path(generation), "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash: nothing after it was acknowledged
+                        logger.warning("Ignoring truncated record in %s",
+                                       self._log_path(generation))
+                        break
+                    if record[0] == "store":
+                        store(tuple(record[1]), record[2], *record[3:])
+                    elif record[0] == "delete":
+                        delete(record[1])
+                    elif record[0] == "remove":
+                        remove(tuple(record[1]), record[2])
+                    else:  # "drop": the key expired or was evicted
+                        drop(tuple(record[1]))
+                    replayed += 1
+
+        logger.info("Recovered snapshot of generation %s and replayed %s records",
+                    snapshot_generation, replayed)
+
+        self.generation = max(generations + [snapshot_generation])
+        self._file = open(self._log_path(self.generation), "ab")
+        if self.group_commit_ms > 0:
+            self._flusher = Thread(target=self._flush_worker, daemon=True)
+            self._flusher.start()
+
+    def write(self, record):
+        """ Buffers a record and returns its sequence number. Must be called in the
+            same critical section that applies the operation to keep both in order """
+
+        line = (json.dumps(record) + "\n").encode()
+        with self._cond:
+            self._written_seq += 1
+            self._pending.append(line)
+            if self.group_commit_ms > 0:
+                self._cond.notify_all()
+            return self._written_seq
+
+    def wait(self, seq):
+        """ Blocks until the record with the given sequence number is durable. Must
+            be called once the storage lock was released """
+
+        if self.group_commit_ms <= 0:
+            # Whoever gets the file first syncs the records of the others too
+            self._sync(seq)
+        with self._cond:
+            while self._synced_seq < seq and not self._closed:
+                self._cond.wait()
+
+    def _sync(self, seq=None):
+        """ Writes and fsyncs the buffered records unless the one with sequence number
+            `seq` already is durable """
+
+        with self._file_lock:
+            with self._cond:
+                if seq is not None and self._synced_seq >= seq:
+                    return
+                lines, self._pending = self._pending, []
+                written_seq = self._written_seq
+            if lines and self._file is not None:
+                self._write_lines(lines)
+            with self._cond:
+                self._synced_seq = max(self._synced_seq, written_seq)
+                self._cond.notify_all()
+
+    def _write_lines(self, lines):
+        """ Writes and fsyncs the lines, switching to the log of a new generation where
+            `rotate` left its number among them. Must be called with the file lock
+            held """
+
+        start = 0
+        for i, line in enumerate(lines):
+            if isinstance(line, int):
+                self._write_and_fsync(lines[start:i])
+                self._file.close()
+                self._file = open(self._log_path(line), "ab")
+                start = i + 1
+        self._write_and_fsync(lines[start:])
+
+    def _write_and_fsync(self, lines):
+        if lines:
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _flush_worker(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            # Let the records of the concurrent writers join the group
+            time.sleep(self.group_commit_ms / 1000)
+            self._sync()
+
+    def rotate(self):
+        """ Starts a new log file and returns its generation. Must be called while the
+            storage is locked, so that the records written until then end up in the log
+            preceding it and the ones written later in the new one. Like `write`, it
+            only buffers the switch, which is done by the next sync """
+
+        with self._cond:
+            self.generation += 1
+            self._pending.append(self.generation)
+            if self.group_commit_ms > 0:
+                self._cond.notify_all()
+            return self.generation
+
+    def write_snapshot(self, items, generation):
+        """ Writes the (key, values, expires_at) items as the snapshot of the storage
+            right before the log of the given generation and removes the older logs """
+
+        # Records preceding the rotation go to the old log, which is about to go
+        self._sync()
+        snapshot_path = os.path.join(self.data_dir, SNAPSHOT_FILE)
+        tmp_path = snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write((json.dumps({"generation": generation}) + "\n").encode())
+            for key, values, expires_at in items:
+                f.write((json.dumps(
+                    [list(key), list(values), expires_at]) + "\n").encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+
+        for old_generation in self._log_generations():
+            if old_generation < generation:
+                os.remove(self._log_path(old_generation))
+
+    def close(self):
+        if self._file is not None and not self._closed:
+            self._sync()
+            with self._file_lock:
+                self._file.close()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class Snapshotter(Thread):
+    """ Periodically snapshots the storage so that its log doesn't grow forever """
+
+    def __init__(self, kv, interval_secs):
+        super().__init__(daemon=True)
+        self._kv = kv
+        self._interval_secs = interval_secs
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval_secs):
+            try:
+                self._kv.snapshot()
+            except Exception as exc:
+                logger.error("Snapshot failed: %s", exc)
+
+    def stop(self):
+        self._stopped.set()
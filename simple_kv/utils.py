@@ -1,4 +1,6 @@
 """ Utility functions used by the kv storage """
+from contextlib import contextmanager
+from threading import Condition, Lock
 import logging
 
 
@@ -19,3 +21,43 @@ def get_logger(name="nameless_logger"):
         logger.addHandler(ch)
 
     return logger
+
+
+class ReadWriteLock:
+    """ Lock that can be held by many readers at once or by a single writer. Waiting
+        writers have priority over new readers so that they don't starve """
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()